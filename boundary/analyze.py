@@ -3,21 +3,19 @@
 
 import json
 import os
-import copy
 import sys
+import time
 from yaml import load, dump, resolver, CLoader as Loader, CDumper as Dumper
 from itertools import islice as skipline
-from itertools import chain as _chain
 from sh import readelf
 
-chain = _chain.from_iterable
-
 # Use set as the default sequencer for yaml
 Loader.add_constructor(
     resolver.BaseResolver.DEFAULT_SEQUENCE_TAG,
     lambda loader, node: set(loader.construct_sequence(node)))
+# Dump sets in sorted order, so outputs are the same between runs
 Dumper.add_representer(
-    set, lambda dumper, node: dumper.represent_list(node))
+    set, lambda dumper, node: dumper.represent_list(sorted(node, key=str)))
 
 
 def read_config():
@@ -29,8 +27,10 @@ def read_config():
 def all_meta_files():
     """Enumerate metadata files provided by collect.py"""
     for r, dirs, files in os.walk('.'):
-        for file in files:
-            if file.endswith('.boundary'):
+        dirs.sort()
+        for file in sorted(files):
+            # *.dwarf.boundary are for comparing collector backends only
+            if file.endswith('.boundary') and not file.endswith('.dwarf.boundary'):
                 path = os.path.join(r, file)
                 assert path.startswith('./')
                 yield path[2:]
@@ -42,7 +42,66 @@ def read_meta(filename):
         return json.load(f)
 
 
-def find_in_vmlinux(vmlinux_elf):
+class Interner(dict):
+    """Map symbols to dense int IDs, sym_id.syms maps them back"""
+
+    def __init__(self):
+        super().__init__()
+        self.syms = []
+
+    def __missing__(self, sym):
+        self[sym] = len(self.syms)
+        self.syms.append(sym)
+        return self[sym]
+
+
+def index_struct(struct_index, meta, sym_id):
+    """Merge struct users of one TU into (struct, file) -> field -> users.
+    Structs of different headers may share a name, so file is in the key.
+    """
+    for struct, prop in meta['struct'].items():
+        entry = struct_index.setdefault((struct, prop['file']), {
+            'name': struct,
+            'file': prop['file'],
+            'all_fields': set(),
+            'users': dict(),
+        })
+        entry['all_fields'].update(prop['all_fields'])
+        for field, users in prop['public_fields'].items():
+            entry['users'].setdefault(field, set()).update(
+                sym_id[tuple(user)] for user in users)
+
+
+def write_if_changed(filename, content):
+    """Keep the mtime of unchanged outputs, so make and ccache can skip
+    rebuilding the module when the boundary stays the same.
+    """
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == content:
+                return
+    with open(filename, 'w') as f:
+        f.write(content)
+
+
+def read_vmlinux_syms(vmlinux_elf):
+    """Read the symbol records find_in_vmlinux() needs. They don't depend
+    on boundary.yaml, so watch mode reads them only once.
+    """
+    syms = []
+    parse_elf = readelf(vmlinux_elf, syms=True, wide=True, _iter=True)
+    for line in skipline(parse_elf, 3, None):
+        fields = line.split()
+        if len(fields) != 8:
+            continue
+        symtype, scope, key = fields[3], fields[4], fields[7]
+        if symtype in ('FILE', 'FUNC') or \
+                (symtype == 'NOTYPE' and key.startswith('__ksymtab_')):
+            syms.append((symtype, scope, key))
+    return syms
+
+
+def find_in_vmlinux(vmlinux_syms):
     """This method connects gcc-plugin with vmlinux (or the ld linker).
     Call this after reading all files and all vagueness has been solved.
     It serves 4 purposes right now:
@@ -79,13 +138,7 @@ def find_in_vmlinux(vmlinux_elf):
     mangled = set()
     in_vmlinux = set()
     fn_pos = {}
-    parse_elf = readelf(vmlinux_elf, syms=True, wide=True, _iter=True)
-    for line in skipline(parse_elf, 3, None):
-        fields = line.split()
-        if len(fields) != 8:
-            continue
-        symtype, scope, key = fields[3], fields[4], fields[7]
-
+    for symtype, scope, key in vmlinux_syms:
         if symtype == 'FILE':
             filename = key
             # Disagreement 1:
@@ -94,14 +147,12 @@ def find_in_vmlinux(vmlinux_elf):
             continue
         elif symtype == 'NOTYPE':
             # find exported function symbol (EXPORT_SYMBOL)
-            if key.startswith('__ksymtab_') and filename in config.mod_files:
+            if filename in config.mod_files:
                 key = key[len('__ksymtab_'):]
                 file = get_in_any(key, config.mod_files)
                 if file:
                     export_func.add((key, file))
             continue
-        elif symtype != 'FUNC':
-            continue
 
         file = filename
         # Disagreement 4
@@ -143,26 +194,27 @@ def find_in_vmlinux(vmlinux_elf):
     }
 
 
-def inflect(initial_insiders, edges):
-    """Mark functions called by outsiders as outsiders too, unless
-    they're interface or sidecar or callback functions.
+def propagate(insiders, outsiders, callees, cut):
+    """Remove insiders called by the outsiders in the worklist, and by
+    those removed in turn. Each outsider is visited once, so this is
+    linear in the edges.
     """
+    while outsiders:
+        for to_sym in callees.get(outsiders.pop(), ()):
+            if to_sym in insiders:
+                insiders.remove(to_sym)
+                if to_sym not in cut:
+                    outsiders.append(to_sym)
+    return insiders
 
-    def inflect_one(edge):
-        to_sym = tuple(edge['to'])
-        if to_sym in insiders:
-            from_sym = tuple(edge['from'])
-            if from_sym not in (insiders | func_class.inflect_cut):
-                return to_sym
-        return None
 
-    insiders = copy.deepcopy(initial_insiders)
-    while True:
-        delete_insider = list(filter(None, list(map(inflect_one, edges))))
-        if not delete_insider:
-            break
-        insiders -= set(delete_insider)
-    return insiders
+def inflect(initial_insiders, callees, cut):
+    """Mark functions called by outsiders as outsiders too, unless
+    they're interface or sidecar or callback functions.
+    """
+    insiders = set(initial_insiders)
+    outsiders = [fn for fn in callees if fn not in insiders and fn not in cut]
+    return propagate(insiders, outsiders, callees, cut)
 
 
 global_fn_dict = {}
@@ -239,18 +291,34 @@ def check_redirect_mangled(f, meta):
     return False
 
 
-def func_class_arithmetics(fns):
-    """Core algorithm of plugsched. Set operations and graph theory."""
-    fns.callback -= fns.interface
+def border_classes(fns):
+    """Functions on the border, and the insiders inflect() starts from"""
+    fns.callback = fns.referenced - fns.interface
     fns.cb_opt = fns.callback - fns.in_vmlinux
     fns.callback -= fns.cb_opt
     fns.border = fns.interface | fns.callback
     # exported function maybe used by kernel modules
     # it can't be internal function
     fns.initial_insider = fns.mod_fns - fns.border - fns.export
+    fns.inflect_cut = fns.border | fns.init | fns.sidecar
 
-    # calc sidecar extraction functions
+
+def outsider_classes(fns):
+    """Classes derived from the inflected insiders"""
+    fns.insider = fns.inflected - fns.init - fns.fake_global
+    fns.sched_outsider = (fns.mod_fns - fns.insider - fns.border) | fns.cb_opt
+    fns.sched_outsider |= fns.fake_global & fns.mod_fns
+    fns.outsider_opt = fns.sched_outsider - fns.in_vmlinux - fns.init
+    fns.tainted = (fns.border | fns.insider | fns.sidecar) & fns.in_vmlinux
+    fns.und = (fns.sched_outsider - fns.outsider_opt) | fns.border | fns.sidecar
+
+
+def func_class_arithmetics(fns):
+    """Core algorithm of plugsched. Set operations and graph theory."""
     fns.sidecar = set(config.sidecar)
+    border_classes(fns)
+
+    # calc sidecar extraction functions
     fns.sdcr_left = sidecar_inflect(fns.sidecar, fns.in_vmlinux)
     fns.sdcr_out = fns.sdcr_fns - fns.sdcr_left
 
@@ -258,14 +326,122 @@ def func_class_arithmetics(fns):
             'Function boundary conflict, please check your sidecar config'
 
     # Inflect outsider functions
-    fns.inflect_cut = fns.border | fns.init | fns.sidecar
-    fns.insider = inflect(fns.initial_insider, edges) - fns.init - fns.fake_global
-    fns.sched_outsider = (fns.mod_fns - fns.insider - fns.border) | fns.cb_opt
-    fns.sched_outsider |= fns.fake_global & fns.mod_fns
-    fns.outsider_opt = fns.sched_outsider - fns.in_vmlinux - fns.init
+    fns.inflected = inflect(fns.initial_insider, callees, fns.inflect_cut)
+    outsider_classes(fns)
     fns.public_user = fns.fn - fns.insider - fns.border
-    fns.tainted = (fns.border | fns.insider | fns.sidecar) & fns.in_vmlinux
-    fns.und = (fns.sched_outsider - fns.outsider_opt) | fns.border | fns.sidecar
+
+
+class Advisor(object):
+    """Estimate how adding or removing one interface function changes the
+    insider, tainted and und sets, and the fan-in of the border, i.e. the
+    callers left in vmlinux which jump into the module. Each candidate
+    only propagates from the changed function, starting from the current
+    result.
+    """
+
+    def __init__(self, fns):
+        self.fns = fns
+        # analyze() replaces the names in config with signatures
+        self.interface = read_config()['function']['interface']
+        self.callers = {}
+        for from_sym, to_syms in callees.items():
+            for to_sym in to_syms:
+                self.callers.setdefault(to_sym, set()).add(from_sym)
+
+    def outside_callers(self, fns, sym):
+        return sum(1 for caller in self.callers.get(sym, ())
+                   if caller not in fns.insider and caller not in fns.border
+                   and caller not in fns.sidecar)
+
+    def fan_in(self, fns, syms=None):
+        entries = fns.border | fns.sidecar
+        if syms is not None:
+            entries &= syms
+        return sum(self.outside_callers(fns, sym) for sym in entries)
+
+    def what_if(self, interface):
+        fns = dotdict(self.fns)
+        fns.interface = interface
+        border_classes(fns)
+        return fns
+
+    def add(self, sym):
+        fns = self.what_if(self.fns.interface | {sym})
+        old = self.fns.inflected
+
+        # Only outsiders reached through sym may become insiders again
+        region, stack = set(), [sym]
+        while stack:
+            for to_sym in callees.get(stack.pop(), ()):
+                if to_sym in fns.initial_insider and to_sym not in old and \
+                        to_sym not in region:
+                    region.add(to_sym)
+                    if to_sym not in fns.inflect_cut:
+                        stack.append(to_sym)
+
+        insiders = old | region
+        outsiders = [caller for fn in region for caller in self.callers.get(fn, ())
+                     if caller not in insiders and caller not in fns.inflect_cut]
+        fns.inflected = propagate(insiders, outsiders, callees, fns.inflect_cut)
+        outsider_classes(fns)
+        return fns
+
+    def remove(self, sym):
+        fns = self.what_if(self.fns.interface - {sym})
+        insiders = self.fns.inflected | (fns.initial_insider & {sym})
+
+        # Only insiders reached through sym may become outsiders
+        if sym in insiders:
+            outsiders = [caller for caller in self.callers.get(sym, ())
+                         if caller not in insiders and caller not in fns.inflect_cut]
+        elif sym not in fns.inflect_cut:
+            outsiders = [sym]
+        else:
+            outsiders = []
+        fns.inflected = propagate(insiders, outsiders, callees, fns.inflect_cut)
+        outsider_classes(fns)
+        return fns
+
+    def fan_in_delta(self, fns):
+        """Only recount entries whose own or callers' classes changed"""
+        base = self.fns
+        changed = (fns.insider ^ base.insider) | (fns.border ^ base.border)
+        affected = set(changed)
+        for sym in changed:
+            affected |= callees.get(sym, set())
+        return self.fan_in(fns, affected) - self.fan_in(base, affected)
+
+    def candidates(self):
+        base = self.fns
+        for sym in sorted(base.interface):
+            if sym[0] in self.interface and not any(
+                    sym[0].startswith(prefix) for prefix in config.interface_prefix):
+                yield 'remove', sym, self.remove(sym)
+
+        # New interfaces must be real symbols, and safe to redirect
+        for sym in sorted(base.sched_outsider):
+            if sym[1] in config.mod_srcs and sym in base.in_vmlinux and \
+                    sym not in base.mangled | base.init | base.fake_global:
+                yield 'add', sym, self.add(sym)
+
+    def report(self, top):
+        base = self.fns
+        rows = []
+        for action, sym, fns in self.candidates():
+            rows.append((len(fns.tainted) - len(base.tainted),
+                         self.fan_in_delta(fns),
+                         len(fns.insider) - len(base.insider),
+                         len(fns.und) - len(base.und),
+                         action, sym))
+        rows.sort()
+
+        print('Current boundary: %d tainted, %d fan-in, %d insider, %d und' % (
+            len(base.tainted), self.fan_in(base), len(base.insider), len(base.und)))
+        print('%8s %8s %8s %8s  %s' % ('tainted', 'fan-in', 'insider', 'und', 'change'))
+        for tainted, fan_in, insider, und, action, sym in rows[:top]:
+            print('%+8d %+8d %+8d %+8d  %s interface %s (%s)' % (
+                tainted, fan_in, insider, und, action, sym[0], sym[1]))
+
 
 def get_func_decl_strs(signatures, fmt):
     """Generate function declaration strings. If both strong and weak
@@ -300,13 +476,10 @@ WEAK_NORM = 3
 WEAK_ARCH = 2
 STRONG    = 1
 
-if __name__ == '__main__':
-    vmlinux = sys.argv[1]
-    # tmp directory to store middle files
-    tmp_dir = sys.argv[2]
-    # directory to store schedule module source code
-    mod_path = sys.argv[3]
 
+
+def load_config():
+    """Stage 1: read boundary.yaml, the only input that changes in watch mode"""
     config = dotdict(read_config())
     config.mod_hdrs = [f for f in config.mod_files if f.endswith('.h')]
     config.mod_srcs = [f for f in config.mod_files if f.endswith('.c')]
@@ -314,47 +487,48 @@ if __name__ == '__main__':
     config.sdcr_srcs = [f[1] for f in config.sidecar]
     config.all_files = config.mod_hdrs + config.mod_srcs + config.sdcr_srcs
     config.fullname = {os.path.basename(f): f for f in config.all_files}
+    return config
+
+
+def load_metas():
+    """Stage 2: read metadata of the whole kernel, resolve global symbols
+    and the call graph. Nothing here depends on boundary.yaml.
+    """
+    global metas_by_name, sym_id, struct_index, kernel_fns, fn_by_sig
+    global fns_of_file, tu_fns, callbacks, callees
 
-    metas = []
     metas_by_name = {}
+    sym_id = Interner()
+    struct_index = {}
     for file in all_meta_files():
         meta = read_meta(file)
-        metas.append(meta)
         metas_by_name[file] = meta
+        index_struct(struct_index, meta, sym_id)
 
-    func_class = dotdict({
+    kernel_fns = dotdict({
         'fn': set(),
         'init': set(),
-        'mod_fns': set(),
-        'callback': set(),
-        'sdcr_fns': set(),
-        'interface': set(),
         'weak': set(),
         'fake_global': set(),
     })
-
-    edges = []
-    decls = {}
-    hdr_sym = {'fn': list(), 'var': list()}
-
-    # first pass: calc init and interface set
-    for meta in metas:
+    # signature -> function, file -> signatures, TU -> functions
+    fn_by_sig = {}
+    fns_of_file = {}
+    tu_fns = {}
+
+    # first pass: calc function sets and global symbols
+    for meta_file, meta in metas_by_name.items():
+        tu = tu_fns.setdefault(meta_file[:-len('.boundary')], [])
         for fn in meta['fn']:
             fn = dotdict(fn)
             fn.signature = tuple(fn.signature)
-            func_class.fn.add(fn.signature)
+            kernel_fns.fn.add(fn.signature)
+            fn_by_sig.setdefault(fn.signature, fn)
+            fns_of_file.setdefault(fn.file, set()).add(fn.signature)
+            tu.append(fn)
 
-            if fn.file in config.mod_files:
-                func_class.mod_fns.add(fn.signature)
-                decls[fn.signature] = fn.decl_str
-            if fn.file in config.sdcr_srcs:
-                func_class.sdcr_fns.add(fn.signature)
-                decls[fn.signature] = fn.decl_str
-
-            if fn.file in config.mod_hdrs:
-                hdr_sym['fn'].append(fn)
             if fn.init:
-                func_class.init.add(fn.signature)
+                kernel_fns.init.add(fn.signature)
             if fn.public:
                 if fn.weak or fn.file.endswith('.c'):
                     global_fn_dict.setdefault(fn.name, set())
@@ -367,10 +541,7 @@ if __name__ == '__main__':
                     global_fn_dict[fn.name].add((STRONG, fn.file))
 
             if fn.weak:
-                func_class.weak.add(fn.signature)
-
-        for fn in meta['interface']:
-            func_class.interface.add(tuple(fn))
+                kernel_fns.weak.add(fn.signature)
 
     for name, fn_list in global_fn_dict.items():
         fn_list = sorted(fn_list)
@@ -379,22 +550,131 @@ if __name__ == '__main__':
         global_fn_dict[name] = fn_list[0][1]
         for prio, file in fn_list[1:]:
             if prio in (WEAK_ARCH, WEAK_NORM):
-                func_class.fake_global.add((name, file))
+                kernel_fns.fake_global.add((name, file))
 
     # second pass: fix vague filename, calc callback and edge set
-    for meta in metas:
+    callbacks = set()
+    callees = {}
+    for meta in metas_by_name.values():
         for callback in meta['callback']:
             callback = lookup_if_global(callback)
-            if callback and callback[1] in config.mod_files:
-                func_class.callback.add(callback)
+            if callback:
+                callbacks.add(callback)
 
         for edge in meta['edge']:
             edge['to'] = lookup_if_global(edge['to'])
             if edge['to']:
-                edges.append(edge)
+                callees.setdefault(tuple(edge['from']), set()).add(edge['to'])
+
+
+def classify():
+    """Stage 3: apply boundary.yaml to the kernel wide function sets"""
+    global func_class, decls, hdr_sym
+
+    func_class = dotdict({
+        'fn': kernel_fns.fn,
+        'init': kernel_fns.init,
+        'weak': kernel_fns.weak,
+        'fake_global': kernel_fns.fake_global,
+        'mod_fns': set(),
+        'sdcr_fns': set(),
+        'interface': set(),
+        'referenced': {cb for cb in callbacks if cb[1] in config.mod_files},
+    })
+    decls = {}
+
+    for file in config.mod_files:
+        func_class.mod_fns |= fns_of_file.get(file, set())
+    for file in config.sdcr_srcs:
+        func_class.sdcr_fns |= fns_of_file.get(file, set())
+    for sig in func_class.mod_fns | func_class.sdcr_fns:
+        decls[sig] = fn_by_sig[sig].decl_str
+
+    # interface candidates must belong to module source files,
+    # sidecars shouldn't treat syscall functions as interfaces
+    for src in config.mod_srcs:
+        for fn in tu_fns.get(src, []):
+            if fn.name in config.function['interface'] or any(
+                    fn.name.startswith(prefix) for prefix in config.interface_prefix):
+                func_class.interface.add(fn.signature)
+
+    # header -> signature -> function, so extracting a header only loads
+    # its own symbols
+    hdr_sym = {hdr: {sig: fn_by_sig[sig] for sig in fns_of_file.get(hdr, set())}
+               for hdr in config.mod_hdrs}
+
+
+def struct_doc():
+    """Struct public fields of mod_hdrs, for boundary_doc.yaml"""
+    mod_hdrs = set(config.mod_hdrs)
+    public_ids = {sym_id[sig] for sig in func_class.public_user if sig in sym_id}
+    struct_properties = dict()
+    for entry in struct_index.values():
+        if entry['file'] not in mod_hdrs:
+            continue
+        field_set = set()
+        user_set = set()
+
+        for field, users in entry['users'].items():
+            p_user = [uid for uid in users if uid in public_ids]
+            if p_user:
+                user_set.update(sym_id.syms[uid] for uid in p_user)
+                field_set.add(field)
+
+        struct_properties[entry['name']] = {
+            'file': entry['file'],
+            'all_fields': entry['all_fields'],
+            'public_fields': field_set,
+            'public_users': user_set,
+        }
+    return struct_properties
+
+
+def write_outputs(local_sympos):
+    """Stage 5: write everything extract.py and the module build need"""
+    for hdr, fns in hdr_sym.items():
+        hdr_f = tmp_dir + 'header_symbol/' + hdr + '.json'
+        os.makedirs(os.path.dirname(hdr_f), exist_ok=True)
+        write_if_changed(hdr_f, json.dumps({
+            'fn': [fns[sig] for sig in sorted(fns)],
+            'var': [],
+        }, indent=4))
+    write_if_changed(tmp_dir + 'boundary_doc.yaml',
+                     dump(struct_doc(), Dumper=Dumper))
+    write_if_changed(tmp_dir + 'boundary_extract.yaml',
+                     dump(dict(config), Dumper=Dumper))
+
+    tnt_fmt = 'TAINTED_FUNCTION({},{})\n'
+    und_fmt = '"{}", {}'
+    cb_fmt = "EXPORT_CALLBACK({fn}, {ret}, {params})\n"
+    export = "EXPORT_PLUGSCHED({fn}, {ret}, {params})\n"
+    unds, taints = [], []
+
+    for fn in sorted(func_class.und):
+        unds.append(und_fmt.format(fn[0], local_sympos.get(fn, 0)))
+
+    # Consistent with kpatch: set global symbol's sympos to 1
+    for fn in sorted(func_class.tainted):
+        taints.append(tnt_fmt.format(fn[0], local_sympos.get(fn, 0) or 1))
+    write_if_changed(mod_path + 'tainted_functions.h', ''.join(taints))
+    write_if_changed(tmp_dir + 'symbol_resolve/undefined_functions.h',
+                     '{%s}' % '},\n{'.join(unds))
+
+    strs = get_func_decl_strs(func_class.callback, cb_fmt)
+    strs |= get_func_decl_strs(func_class.interface, export)
+    strs |= get_func_decl_strs(func_class.sidecar, export)
+    write_if_changed(mod_path + 'export_jump.h', ''.join(sorted(strs)))
 
-    vmlinux_info = find_in_vmlinux(vmlinux)
-    local_sympos = vmlinux_info['local_sympos']
+
+def analyze(write=True):
+    """Stages that depend on boundary.yaml, re-run by watch mode"""
+    global config
+
+    config = load_config()
+    classify()
+
+    # Stage 4: vmlinux symbols and the core algorithm
+    vmlinux_info = find_in_vmlinux(vmlinux_syms)
     func_class.in_vmlinux = vmlinux_info['in_vmlinux']
     func_class.mangled = vmlinux_info['mangled']
     func_class.export = vmlinux_info['export']
@@ -407,61 +687,65 @@ if __name__ == '__main__':
     for output_item in classes_out:
         config.function[output_item] = func_class[output_item]
 
-    # Handle Struct public fields. The right hand side gives an example
-    struct_properties = dict()
-    for struct in set(chain(m['struct'].keys() for m in metas)):
-        struct_properties[struct] = dict()
-        all_set = set()
-        field_set = set()
-        user_set = set()
-
-        for m in metas:
-            if struct not in m['struct']:
-                continue
-            all_set |= set(m['struct'][struct]['all_fields'])
-
-            for field, users in m['struct'][struct]['public_fields'].items():
-                p_user = set(map(tuple, users)) & func_class.public_user
-                if p_user:
-                    user_set |= p_user
-                    field_set.add(field)
-
-        struct_properties[struct]['all_fields'] = all_set
-        struct_properties[struct]['public_fields'] = field_set
-        struct_properties[struct]['public_users'] = user_set
-
     # Sanity checks
     for sym in (func_class.sidecar | func_class.border) & func_class.mangled:
         meta = metas_by_name[sym[1] + '.boundary']
         assert not check_redirect_mangled(sym, meta), \
             "trying to redirect the mangled function %s (%s)" % sym
 
-    with open(tmp_dir + 'header_symbol.json', 'w') as f:
-        json.dump(hdr_sym, f, indent=4)
-    with open(tmp_dir + 'boundary_doc.yaml', 'w') as f:
-        dump(struct_properties, f, Dumper)
-    with open(tmp_dir + 'boundary_extract.yaml', 'w') as f:
-        dump(dict(config), f, Dumper)
+    if write:
+        write_outputs(vmlinux_info['local_sympos'])
 
-    tnt_fmt = 'TAINTED_FUNCTION({},{})\n'
-    und_fmt = '"{}", {}'
-    cb_fmt = "EXPORT_CALLBACK({fn}, {ret}, {params})\n"
-    export = "EXPORT_PLUGSCHED({fn}, {ret}, {params})\n"
-    mod_fmt = '__mod_{}\n'
-    unds, taints = [], []
 
-    for fn in func_class.und:
-        unds.append(und_fmt.format(fn[0], local_sympos.get(fn, 0)))
+def watch(interval=0.5):
+    """Re-analyze whenever boundary.yaml changes. Metadata, vmlinux symbols
+    and the call graph stay in memory, so only the cheap stages re-run.
+    """
+    config_f = tmp_dir + 'boundary.yaml'
+    last = os.stat(config_f).st_mtime
+    print('Watching %s, press Ctrl-C to stop' % config_f)
 
-    # Consistent with kpatch: set global symbol's sympos to 1
-    for fn in func_class.tainted:
-        taints.append(tnt_fmt.format(fn[0], local_sympos.get(fn, 0) or 1))
-    with open(mod_path + 'tainted_functions.h', 'w') as f:
-        f.writelines(taints)
-    with open(tmp_dir + 'symbol_resolve/undefined_functions.h', 'w') as f:
-        f.write('{%s}' % '},\n{'.join(unds))
-    with open(mod_path + 'export_jump.h', 'w') as f:
-        strs = get_func_decl_strs(func_class.callback, cb_fmt)
-        strs |= get_func_decl_strs(func_class.interface, export)
-        strs |= get_func_decl_strs(func_class.sidecar, export)
-        f.writelines(sorted(strs))
+    while True:
+        time.sleep(interval)
+        try:
+            mtime = os.stat(config_f).st_mtime
+        except FileNotFoundError:
+            # Editors may replace the file when saving
+            continue
+        if mtime == last:
+            continue
+        last = mtime
+
+        start = time.time()
+        try:
+            analyze()
+        except Exception as e:
+            # Keep watching, the next edit may fix the config
+            print('error: %s: %s' % (type(e).__name__, e))
+            continue
+        print('Boundary updated in %.2fs' % (time.time() - start))
+
+
+if __name__ == '__main__':
+    vmlinux = sys.argv[1]
+    # tmp directory to store middle files
+    tmp_dir = sys.argv[2]
+    # directory to store schedule module source code
+    mod_path = sys.argv[3]
+
+    opts = sys.argv[4:]
+
+    load_metas()
+    vmlinux_syms = read_vmlinux_syms(vmlinux)
+
+    if opts[:1] == ['--advise']:
+        analyze(write=False)
+        Advisor(func_class).report(int(opts[1]) if len(opts) > 1 else 20)
+    else:
+        analyze()
+
+    if opts == ['--watch']:
+        try:
+            watch()
+        except KeyboardInterrupt:
+            pass
@@ -1,19 +1,16 @@
 #!/usr/bin/env python3
 # Copyright 2019-2022 Alibaba Group Holding Limited.
 # SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
-"""Use GCC Python Plugin to collect source code information"""
+"""Use GCC Python Plugin to collect source code information. The output
+doesn't depend on boundary.yaml, analyze.py applies the config, so one
+collection of a kernel serves any number of boundary configs.
+"""
 
 import re
 import os
 import json
 from collections import defaultdict
 from itertools import groupby as _groupby
-from yaml import load, resolver, CLoader as Loader
-
-# Use set as the default sequencer for yaml
-Loader.add_constructor(
-    resolver.BaseResolver.DEFAULT_SEQUENCE_TAG,
-    lambda loader, node: set(loader.construct_sequence(node)))
 
 
 class GccBugs(object):
@@ -39,11 +36,12 @@ class GccBugs(object):
 
     @staticmethod
     def enum_type_name(decl, str):
-        if isinstance(decl.type, gcc.EnumeralType):
+        # anonymous enums have no name to prefix
+        if isinstance(decl.type, gcc.EnumeralType) and decl.type.name:
             i = str.find(decl.type.name.name)
-            return str[:i] + 'enum ' + str[i:]
-        else:
-            return str
+            if i >= 0:
+                return str[:i] + 'enum ' + str[i:]
+        return str
 
     @staticmethod
     def is_val_list(arg):
@@ -91,21 +89,12 @@ class GccBugs(object):
 
 class Collection(object):
 
-    def __init__(self, tmp_dir):
-        with open(tmp_dir + 'boundary.yaml') as f:
-            self.config = load(f, Loader)
-
+    def __init__(self):
         self.fn_prop = []
         self.cb_prop = []
         self.var_prop = []
-        self.intf_prop = []
         self.edge_prop = []
         self.struct_prop = {}
-        self.mod_files = self.config['mod_files']
-        self.mod_hdrs = [f for f in self.mod_files if f.endswith('.h')]
-        self.mod_srcs = [f for f in self.mod_files if f.endswith('.c')]
-        self.sdcr = self.config['sidecar'] or set()
-        self.sdcr_srcs = [f[1] for f in self.sdcr]
 
     def relpath(self, decl):
         """Get relative path from declaration object"""
@@ -133,9 +122,7 @@ class Collection(object):
         return '__weak__' in decl.attributes or 'weak' in decl.attributes
 
     def collect_fn(self):
-        """Collect all funtion properties, including interface functions"""
-        src_f = gcc.get_main_input_filename()
-
+        """Collect all funtion properties"""
         for node in gcc.get_callgraph_nodes():
             decl = node.decl
             if not isinstance(decl.context, gcc.TranslationUnitDecl):
@@ -161,32 +148,16 @@ class Collection(object):
                 'inline': decl.inline or 'always_inline' in decl.attributes,
                 'weak': self.decl_is_weak(decl),
                 'signature': self.decl_sig(decl),
-                'decl_str': None,
-            }
-            self.fn_prop.append(properties)
-
-            # interface candidates must belongs to module source files
-            if src_f in self.mod_srcs + self.sdcr_srcs:
-                decl_str = {
+                'decl_str': {
                     'fn': decl.name,
                     'ret': GccBugs.fix(decl.result, decl.result.type.str_no_uid),
                     'params': ', '.join(GccBugs.fix(arg, arg.type.str_no_uid) \
                             for arg in decl.arguments) if decl.arguments else 'void'
-                }
-
-                GccBugs.variadic_function(decl, decl_str)
-                properties['decl_str'] = decl_str
-
-                interface = self.config['function']['interface']
-                syscall = self.config['interface_prefix']
+                },
+            }
 
-                # sidecars shouln't treat syscall funtions as interfaces
-                if src_f in self.mod_srcs and (
-                    decl.name in interface or any(
-                        decl.name.startswith(prefix) for prefix in syscall
-                    )
-                ):
-                    self.intf_prop.append(list(self.decl_sig(decl)))
+            GccBugs.variadic_function(decl, properties['decl_str'])
+            self.fn_prop.append(properties)
 
     def collect_var(self):
         """Collect properties of all global variables"""
@@ -205,14 +176,12 @@ class Collection(object):
                 'external': decl.external,
                 'public': decl.public,
                 'static': decl.static,
-                'decl_str': None,
             }
 
             # tricky skill to get right str_decl
-            if decl.location.file in self.mod_srcs + self.sdcr_srcs:
-                decl_str = decl.str_decl.split('=')[0].strip(' ;') + ';'
-                decl_str = decl_str.replace('static ', 'extern ')
-                properties['decl_str'] = GccBugs.fix(decl, decl_str)
+            decl_str = decl.str_decl.split('=')[0].strip(' ;') + ';'
+            decl_str = decl_str.replace('static ', 'extern ')
+            properties['decl_str'] = GccBugs.fix(decl, decl_str)
 
             self.var_prop.append(properties)
 
@@ -261,8 +230,9 @@ class Collection(object):
                 while op.field.name is None and op in parent_component_ref:
                     op = parent_component_ref[op]
 
+                # analyze.py picks the structs of mod_hdrs
                 loc_file = self.relpath(context.stub)
-                if loc_file in self.mod_hdrs and context.name is not None:
+                if loc_file.endswith('.h') and context.name is not None:
                     """When acecssing 2 32bit fields at one time, the AST
                     ancestor is BitFieldRef. And op.field.name is None
                     """
@@ -281,8 +251,11 @@ class Collection(object):
             return dict((k, list(map(selector, v)))
                         for k, v in _groupby(sorted_list, grouper))
 
+        # Structs of all headers are collected, keyed by name only, so
+        # analyze.py tells same named structs apart by 'file'
         for struct, user_fields in public_fields.items():
             self.struct_prop[struct.name.name] = {
+                'file': self.relpath(struct.stub),
                 'all_fields': [f.name for f in struct.fields if f.name],
                 'public_fields': groupby(user_fields,
                     grouper=lambda user_field: user_field[1],
@@ -349,7 +322,6 @@ class Collection(object):
             'var': self.var_prop,
             'edge': self.edge_prop,
             'callback': self.cb_prop,
-            'interface': self.intf_prop,
             'struct': self.struct_prop
         }
 
@@ -364,7 +336,5 @@ class Collection(object):
 if __name__ == '__main__':
     import gcc
 
-    # tmp directory to store middle files
-    tmp_dir = gcc.argument_dict['tmpdir']
-    collect = Collection(tmp_dir)
+    collect = Collection()
     collect.register_cbs()
@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+# Copyright 2019-2023 Alibaba Group Holding Limited.
+# SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
+"""Collect source code information from the objects of an ordinary build,
+for when the GCC Python Plugin is unavailable. Produces *.boundary files
+in the format of collect.py, from DWARF, symbol tables, relocations and
+objdump. It hasn't been compared with the plugin on a real tree yet, run
+tools/boundary_diff.py before relying on it.
+
+Differences from collect.py:
+  - Calls inlined into their callers come from DW_TAG_inlined_subroutine,
+    calls removed entirely by the optimizer are not seen.
+  - Struct field users can't be told from objects, 'struct' is empty.
+  - Functions split into hot and cold parts have DW_AT_ranges instead of
+    DW_AT_low_pc. They count as defined, but this hasn't been checked
+    against the plugin with tools/boundary_diff.py yet.
+  - Any non-call reference to a function in code, eg. lea or mov of its
+    address, is a callback. This includes references the compiler adds
+    on its own, which the plugin never sees.
+  - In data, only relocations inside variables (STT_OBJECT symbols) are
+    callbacks, like the plugin walking variable initializers. Tables the
+    toolchain emits, eg. __mcount_loc or .orc_unwind_ip, are skipped.
+
+Usage: collect_dwarf.py [<suffix> [<obj>...]]
+"""
+
+import re
+import os
+import sys
+import json
+import logging
+from multiprocessing import Pool, cpu_count
+from elftools.elf.elffile import ELFFile
+from elftools.elf.constants import SH_FLAGS
+from elftools.elf.relocation import RelocationSection
+from elftools.elf.sections import SymbolTableSection
+from sh import objdump
+
+# Attributes of a subprogram with code, hot/cold split ones have no low_pc
+CODE_ATTRS = ('DW_AT_low_pc', 'DW_AT_ranges', 'DW_AT_entry_pc')
+
+# Instructions making direct calls or tail calls
+CALL_INSNS = {'call', 'callq', 'jmp', 'jmpq', 'bl', 'b'}
+# Objects that are not a single C translation unit
+SKIP_OBJS = re.compile(r'(\.mod\.o|/vmlinux\.o|/built-in\.o|\.stub\.o)$')
+
+label_re = re.compile(r'^([0-9a-f]+) <(.+)>:$')
+insn_re = re.compile(r'^\s*[0-9a-f]+:\t(?:(?:notrack|bnd|lock) )*(\S+)\s*(.*)$')
+reloc_re = re.compile(r'^\s*[0-9a-f]+: (R_\w+)\s+([^\s+-]+)([+-]0x[0-9a-f]+)?$')
+target_re = re.compile(r'<([^<>+]+)>$')
+# objdump -w prints relocations after the instruction since binutils 2.3x
+inline_reloc_re = re.compile(r'\t([0-9a-f]+: R_\w+\s+\S+)$')
+
+
+def base_name(sym):
+    """foo.isra.0, foo.constprop.1, foo.cold -> foo"""
+    return sym.split('.')[0] if not sym.startswith('.') else sym
+
+
+class Source(object):
+    """Source lines, to find what DWARF doesn't record, eg. braces"""
+
+    def __init__(self):
+        self.cache = {}
+
+    def lines(self, path):
+        if path not in self.cache:
+            try:
+                with open(path, errors='replace') as f:
+                    self.cache[path] = f.readlines()
+            except IOError:
+                self.cache[path] = []
+        return self.cache[path]
+
+    def name_col(self, path, row, name):
+        lines = self.lines(path)
+        if row >= len(lines):
+            return 0
+        col = lines[row].find(name)
+        return max(col, 0)
+
+    def body(self, path, row, col):
+        """Locations of the braces of the function body after (row, col),
+        skipping comments, strings and parameter lists.
+        """
+        lines = self.lines(path)
+        depth, paren, l_brace = 0, 0, None
+        in_comment = False
+
+        while row < len(lines):
+            line = lines[row]
+            while col < len(line):
+                c, pair = line[col], line[col:col + 2]
+                if in_comment:
+                    if pair == '*/':
+                        in_comment = False
+                        col += 1
+                elif pair == '/*':
+                    in_comment = True
+                    col += 1
+                elif pair == '//':
+                    break
+                elif c in '"\'':
+                    end = col + 1
+                    while end < len(line) and line[end] != c:
+                        end += 2 if line[end] == '\\' else 1
+                    col = end
+                elif c == '(':
+                    paren += 1
+                elif c == ')':
+                    paren -= 1
+                elif c == ';' and paren == 0 and depth == 0:
+                    return None, None
+                elif c == '{' and paren == 0:
+                    if depth == 0:
+                        l_brace = (row, col)
+                    depth += 1
+                elif c == '}' and paren == 0 and depth:
+                    depth -= 1
+                    if depth == 0:
+                        return l_brace, (row, col)
+                col += 1
+            row, col = row + 1, 0
+
+        return None, None
+
+
+class ObjectCollection(object):
+    """Collect one object, the counterpart of collect.Collection"""
+
+    def __init__(self, source, obj):
+        self.source = source
+        self.obj = obj
+        self.fn_prop = []
+        self.cb_prop = []
+        self.var_prop = []
+        self.edge_prop = []
+
+        # function name -> signature of functions with a body in this TU
+        self.defined = {}
+        # all functions declared or defined in this TU
+        self.fn_names = set()
+        # object symbol name -> type name, to skip struct sched_class
+        self.var_type = {}
+
+    # DWARF helpers
+
+    def has_code(self, die):
+        return any(attr in die.attributes for attr in CODE_ATTRS)
+
+    def attr(self, die, name):
+        """Attribute of die, falling back to its abstract origin and
+        declaration, where GCC puts names, types and locations.
+        """
+        seen = 0
+        while die is not None and seen < 4:
+            if name in die.attributes:
+                return die.attributes[name].value
+            for ref in ('DW_AT_abstract_origin', 'DW_AT_specification'):
+                if ref in die.attributes:
+                    die = die.get_DIE_from_attribute(ref)
+                    break
+            else:
+                return None
+            seen += 1
+        return None
+
+    def ref(self, die, name):
+        seen = 0
+        while die is not None and seen < 4:
+            if name in die.attributes:
+                return die.get_DIE_from_attribute(name)
+            for ref in ('DW_AT_abstract_origin', 'DW_AT_specification'):
+                if ref in die.attributes:
+                    die = die.get_DIE_from_attribute(ref)
+                    break
+            else:
+                return None
+            seen += 1
+        return None
+
+    def origin(self, die):
+        while die is not None and 'DW_AT_abstract_origin' in die.attributes:
+            die = die.get_DIE_from_attribute('DW_AT_abstract_origin')
+        return die
+
+    def name(self, die):
+        name = self.attr(die, 'DW_AT_name')
+        return name.decode() if name is not None else None
+
+    def decl_file(self, die):
+        idx = self.attr(die, 'DW_AT_decl_file')
+        if idx is None:
+            return None
+        return self.files.get(idx)
+
+    def decl_row(self, die):
+        line = self.attr(die, 'DW_AT_decl_line')
+        return line - 1 if line else 0
+
+    def decl_col(self, die, path, row, name):
+        col = self.attr(die, 'DW_AT_decl_column')
+        if col:
+            return col - 1
+        return self.source.name_col(path, row, name)
+
+    def file_table(self, cu):
+        """DW_AT_decl_file index -> path relative to the source tree"""
+        lineprog = self.dwarf.line_program_for_CU(cu)
+        top = cu.get_top_DIE()
+        comp_dir = top.attributes['DW_AT_comp_dir'].value.decode()
+        version = lineprog.header['version']
+        dirs = [d.decode() if isinstance(d, bytes) else d.DW_LNCT_path.decode()
+                for d in lineprog.header['include_directory']]
+        files = {}
+
+        for i, entry in enumerate(lineprog.header['file_entry']):
+            if isinstance(entry.name, bytes):
+                name = entry.name.decode()
+            else:
+                name = entry.DW_LNCT_path.decode()
+            if version < 5:
+                d = dirs[entry.dir_index - 1] if entry.dir_index else comp_dir
+                idx = i + 1
+            else:
+                d = dirs[entry.dir_index] if dirs else comp_dir
+                idx = i
+            path = os.path.normpath(os.path.join(comp_dir, d, name))
+            files[idx] = os.path.relpath(path)
+
+        return files
+
+    def type_name(self, die):
+        tag = die.tag
+        name = self.name(die)
+        if tag == 'DW_TAG_structure_type':
+            return 'struct ' + (name or '{...}')
+        elif tag == 'DW_TAG_union_type':
+            return 'union ' + (name or '{...}')
+        elif tag == 'DW_TAG_enumeration_type':
+            return 'enum ' + (name or '{...}')
+        return name or 'void'
+
+    def decl_str(self, die, inner=''):
+        """C declarator of type die around inner, like GCC's str_decl"""
+        if die is None:
+            return ('void ' + inner).strip()
+
+        tag = die.tag
+        target = self.ref(die, 'DW_AT_type')
+
+        if tag == 'DW_TAG_pointer_type':
+            if target is not None and target.tag in (
+                    'DW_TAG_array_type', 'DW_TAG_subroutine_type'):
+                return self.decl_str(target, '(*%s)' % inner)
+            return self.decl_str(target, '*' + inner)
+        elif tag in ('DW_TAG_const_type', 'DW_TAG_volatile_type'):
+            qual = 'const' if tag == 'DW_TAG_const_type' else 'volatile'
+            if target is not None and target.tag == 'DW_TAG_pointer_type':
+                return self.decl_str(target, ' %s %s' % (qual, inner))
+            return qual + ' ' + self.decl_str(target, inner)
+        elif tag == 'DW_TAG_array_type':
+            dims = ''
+            for sub in die.iter_children():
+                if sub.tag != 'DW_TAG_subrange_type':
+                    continue
+                if 'DW_AT_count' in sub.attributes:
+                    dims += '[%d]' % sub.attributes['DW_AT_count'].value
+                elif 'DW_AT_upper_bound' in sub.attributes:
+                    dims += '[%d]' % (sub.attributes['DW_AT_upper_bound'].value + 1)
+                else:
+                    dims += '[]'
+            return self.decl_str(target, inner + dims)
+        elif tag == 'DW_TAG_subroutine_type':
+            return self.decl_str(target, '%s(%s)' % (inner, self.params(die)))
+        elif tag in ('DW_TAG_restrict_type', 'DW_TAG_atomic_type'):
+            return self.decl_str(target, inner)
+
+        name = self.type_name(die)
+        if not inner:
+            return name
+        return name + ' ' + inner.lstrip() if inner[0] != '[' else name + inner
+
+    def params(self, die):
+        params, variadic = [], False
+        for child in die.iter_children():
+            if child.tag == 'DW_TAG_formal_parameter':
+                params.append(self.decl_str(self.ref(child, 'DW_AT_type')))
+            elif child.tag == 'DW_TAG_unspecified_parameters':
+                variadic = True
+        if not params:
+            return 'void'
+        return ', '.join(params) + (', ...' if variadic else '')
+
+    # ELF helpers
+
+    def load_symbols(self):
+        """Function symbols by section, for address to function lookups"""
+        self.sections = [s.name for s in self.elf.iter_sections()]
+        self.exec_sections = {i for i, s in enumerate(self.elf.iter_sections())
+                              if s['sh_flags'] & SH_FLAGS.SHF_EXECINSTR}
+        self.symbols = []
+        self.func_at = {}
+        self.obj_at = {}
+        self.weak = set()
+        self.sym_section = {}
+
+        symtab = self.elf.get_section_by_name('.symtab')
+        if not isinstance(symtab, SymbolTableSection):
+            return
+
+        for sym in symtab.iter_symbols():
+            self.symbols.append(sym)
+            shndx = sym['st_shndx']
+            if not isinstance(shndx, int):
+                continue
+            kind = sym['st_info']['type']
+            if kind == 'STT_FUNC':
+                self.func_at.setdefault((shndx, sym['st_value']), sym.name)
+                self.sym_section[sym.name] = self.sections[shndx]
+                if sym['st_info']['bind'] == 'STB_WEAK':
+                    self.weak.add(sym.name)
+            elif kind == 'STT_OBJECT':
+                self.obj_at.setdefault(shndx, []).append(
+                    (sym['st_value'], sym['st_value'] + sym['st_size'], sym.name))
+
+    def is_fn(self, name):
+        return name in self.sym_section or name in self.fn_names
+
+    def same_function(self, caller, target):
+        """Jumps between foo and foo.cold are not edges, while recursive
+        calls are, like the plugin's collect_edge.
+        """
+        return target != caller and base_name(target) == base_name(caller)
+
+    def section_func(self, shndx, addend):
+        """Function at section offset, PC relative addends are off by
+        the size of the displacement.
+        """
+        return self.func_at.get((shndx, addend)) or \
+            self.func_at.get((shndx, addend + 4))
+
+    def reloc_target(self, sym, addend):
+        """Function referred by a relocation, either by name or by
+        section symbol plus offset.
+        """
+        kind = sym['st_info']['type']
+        shndx = sym['st_shndx']
+        if kind == 'STT_SECTION' and isinstance(shndx, int):
+            return self.func_at.get((shndx, addend))
+        if self.is_fn(sym.name):
+            return sym.name
+        return None
+
+    def is_init(self, sym):
+        return self.sym_section.get(sym, '').startswith('.init.text')
+
+    def sig(self, name):
+        """Same as collect.Collection.decl_sig"""
+        name = base_name(name)
+        if name in self.defined:
+            return self.defined[name]
+        return (name, '?')
+
+    # Collectors
+
+    def collect_fn(self, cu):
+        for die in cu.get_top_DIE().iter_children():
+            if die.tag != 'DW_TAG_subprogram':
+                continue
+            name = self.name(die)
+            if name:
+                self.fn_names.add(name)
+            if 'DW_AT_declaration' in die.attributes:
+                continue
+            if not self.has_code(die) and 'DW_AT_inline' not in die.attributes:
+                continue
+            file = self.decl_file(die)
+            if not name or not file or name in self.defined:
+                continue
+
+            row = self.decl_row(die)
+            col = self.decl_col(die, file, row, name)
+            l_brace, r_brace = self.source.body(file, row, col)
+            if l_brace is None:
+                continue
+
+            inline = self.attr(die, 'DW_AT_inline') in (2, 3)
+            signature = (name, file)
+            self.defined[name] = signature
+
+            properties = {
+                'name': name,
+                'init': self.is_init(name),
+                'file': file,
+                'l_brace_loc': l_brace,
+                'r_brace_loc': r_brace,
+                'name_loc': (row, col),
+                'external': False,
+                'public': bool(self.attr(die, 'DW_AT_external')),
+                'static': True,
+                'inline': inline,
+                'weak': name in self.weak,
+                'signature': signature,
+                'decl_str': {
+                    'fn': name,
+                    'ret': self.decl_str(self.ref(die, 'DW_AT_type')),
+                    'params': self.params(self.origin(die)),
+                },
+            }
+            self.fn_prop.append(properties)
+
+    def collect_var(self, cu):
+        dies = [die for die in cu.get_top_DIE().iter_children()
+                if die.tag == 'DW_TAG_variable']
+        # Declarations completed by a definition in this TU
+        specs = {die.get_DIE_from_attribute('DW_AT_specification').offset
+                 for die in dies if 'DW_AT_specification' in die.attributes}
+
+        for die in dies:
+            if die.offset in specs:
+                continue
+            name = self.name(die)
+            file = self.decl_file(die)
+            if not name or not file:
+                continue
+
+            type_die = self.ref(die, 'DW_AT_type')
+            row = self.decl_row(die)
+            base = type_die
+            while base is not None and base.tag in (
+                    'DW_TAG_pointer_type', 'DW_TAG_array_type',
+                    'DW_TAG_const_type', 'DW_TAG_volatile_type'):
+                base = self.ref(base, 'DW_AT_type')
+            start = row
+            if base is not None and base.tag in (
+                    'DW_TAG_structure_type', 'DW_TAG_enumeration_type') \
+                    and self.name(base) is None:
+                start = self.decl_row(base)
+            if base is not None:
+                self.var_type[name] = self.name(base)
+
+            external = 'DW_AT_declaration' in die.attributes
+            public = bool(self.attr(die, 'DW_AT_external'))
+            properties = {
+                'name': name,
+                'file': file,
+                'name_loc': (row, self.decl_col(die, file, row, name)),
+                'decl_start_line': start,
+                'external': external,
+                'public': public,
+                'static': not external,
+            }
+
+            decl_str = self.decl_str(type_die, name) + ';'
+            properties['decl_str'] = decl_str if public else 'extern ' + decl_str
+
+            self.var_prop.append(properties)
+
+    def collect_inlined(self, cu):
+        """Calls inlined by GCC, which leave no call instruction"""
+        def walk(die, caller):
+            for child in die.iter_children():
+                if child.tag == 'DW_TAG_inlined_subroutine':
+                    callee = self.name(child)
+                    if callee:
+                        edges.add((caller, callee))
+                        walk(child, callee)
+                        continue
+                walk(child, caller)
+
+        edges = set()
+        for die in cu.get_top_DIE().iter_children():
+            if die.tag == 'DW_TAG_subprogram' and self.has_code(die):
+                caller = self.name(die)
+                if caller and not self.is_init(caller):
+                    walk(die, caller)
+
+        for caller, callee in sorted(edges):
+            self.edge_prop.append({'from': self.sig(caller), 'to': self.sig(callee)})
+
+    def collect_code(self):
+        """Direct calls and function references in code, from objdump"""
+        edges, callbacks = set(), set()
+        caller, mnemonic, exec_section = None, None, False
+        section_idx = {name: i for i, name in enumerate(self.sections)}
+
+        def split_relocs(out):
+            for line in out:
+                line = line.rstrip('\n')
+                m = inline_reloc_re.search(line)
+                if m:
+                    yield line[:m.start()].rstrip()
+                    yield '  ' + m.group(1)
+                else:
+                    yield line
+
+        out = objdump('-dr', '-w', '--no-show-raw-insn', self.obj, _iter=True)
+        for line in split_relocs(out):
+            if line.startswith('Disassembly of section '):
+                section = line[len('Disassembly of section '):].rstrip(':')
+                exec_section = section_idx.get(section) in self.exec_sections
+                continue
+
+            m = label_re.match(line)
+            if m:
+                label = m.group(2)
+                caller = None if self.is_init(label) else label
+                mnemonic = None
+                continue
+            if caller is None or not exec_section:
+                continue
+
+            m = reloc_re.match(line)
+            if m:
+                target = m.group(2)
+                # Section relative relocations, eg. lea .text+0x120
+                if target.startswith('.') and target in section_idx:
+                    target = self.section_func(section_idx[target],
+                                               int(m.group(3) or '0', 16))
+                if not target or not self.is_fn(target) or \
+                        self.same_function(caller, target):
+                    continue
+                if mnemonic in CALL_INSNS:
+                    edges.add((caller, target))
+                elif not self.is_init(target):
+                    callbacks.add(target)
+                continue
+
+            m = insn_re.match(line)
+            if not m:
+                continue
+            mnemonic = m.group(1)
+            t = target_re.search(m.group(2))
+            if not t or t.group(1) not in self.sym_section:
+                continue
+            target = t.group(1)
+            if self.same_function(caller, target):
+                continue
+            if mnemonic in CALL_INSNS:
+                edges.add((caller, target))
+            elif not self.is_init(target):
+                callbacks.add(target)
+
+        for caller, target in sorted(edges):
+            self.edge_prop.append({'from': self.sig(caller), 'to': self.sig(target)})
+        for cb in sorted(callbacks):
+            self.cb_prop.append(list(self.sig(cb)))
+
+    def collect_data_refs(self):
+        """Functions referred by variable initializers, from relocations"""
+        for rel in self.elf.iter_sections():
+            if not isinstance(rel, RelocationSection):
+                continue
+            shndx = rel['sh_info']
+            if shndx in self.exec_sections or shndx >= len(self.sections):
+                continue
+            section = self.sections[shndx]
+            if section.startswith('.debug') or section == '.discard.addressable':
+                continue
+            if not self.elf.get_section(shndx)['sh_flags'] & SH_FLAGS.SHF_ALLOC:
+                continue
+
+            symtab = self.elf.get_section(rel['sh_link'])
+            objs = self.obj_at.get(shndx, [])
+            for r in rel.iter_relocations():
+                sym = symtab.get_symbol(r['r_info_sym'])
+                target = self.reloc_target(sym, r.entry.get('r_addend', 0))
+                if not target or self.is_init(target):
+                    continue
+                # Only variables, not tables pointing at each function
+                # like __mcount_loc, __patchable_function_entries and
+                # .orc_unwind_ip. struct sched_class is purely private.
+                owner = [o for o in objs if o[0] <= r['r_offset'] < o[1]]
+                if not owner or self.var_type.get(owner[0][2]) == 'sched_class':
+                    continue
+                self.cb_prop.append(list(self.sig(target)))
+
+    def collect_aliases(self):
+        """Function symbols without DWARF are aliases of the function at
+        the same address, like collect.Collection.collect_edge does.
+        """
+        by_addr = {}
+        for (shndx, addr), name in self.func_at.items():
+            by_addr.setdefault((shndx, addr), set()).add(name)
+        for sym in self.symbols:
+            shndx = sym['st_shndx']
+            if sym['st_info']['type'] != 'STT_FUNC' or not isinstance(shndx, int):
+                continue
+            name = sym.name
+            if name in self.defined or '.' in name or self.is_init(name):
+                continue
+            for real in by_addr.get((shndx, sym['st_value']), ()):
+                if real != name and real in self.defined:
+                    self.edge_prop.append({'from': (name, '?'), 'to': (real, '?')})
+
+    def collect(self):
+        with open(self.obj, 'rb') as f:
+            self.elf = ELFFile(f)
+            if not self.elf.has_dwarf_info():
+                return None
+            self.dwarf = self.elf.get_dwarf_info()
+            cus = list(self.dwarf.iter_CUs())
+            if len(cus) != 1:
+                return None
+            cu = cus[0]
+            top = cu.get_top_DIE()
+            self.src_f = os.path.relpath(os.path.join(
+                top.attributes['DW_AT_comp_dir'].value.decode(),
+                top.attributes['DW_AT_name'].value.decode()))
+            if not self.src_f.endswith('.c') or self.src_f.startswith('..'):
+                return None
+
+            self.files = self.file_table(cu)
+            self.load_symbols()
+            self.collect_fn(cu)
+            self.collect_var(cu)
+            self.collect_inlined(cu)
+            self.collect_data_refs()
+            self.collect_aliases()
+
+        self.collect_code()
+
+        # Keep the order of first appearance, like the plugin does
+        self.cb_prop = [list(cb) for cb in dict.fromkeys(map(tuple, self.cb_prop))]
+
+        return {
+            'fn': self.fn_prop,
+            'var': self.var_prop,
+            'edge': self.edge_prop,
+            'callback': self.cb_prop,
+            'struct': {},
+            'src': self.src_f,
+        }
+
+
+def init_worker():
+    global source
+    source = Source()
+
+
+def collect_one(args):
+    obj, suffix = args
+    try:
+        collection = ObjectCollection(source, obj).collect()
+    except Exception as e:
+        return obj, 'failed: %s' % e
+    if collection is None:
+        return obj, None
+
+    # The plugin writes <source>.boundary, keep the same name
+    src_f = collection.pop('src')
+    with open(src_f + suffix, 'w') as f:
+        json.dump(collection, f, indent=4)
+    return obj, src_f
+
+
+def all_objects():
+    for r, dirs, files in os.walk('.'):
+        for file in files:
+            path = os.path.join(r, file)[2:]
+            if file.endswith('.o') and not SKIP_OBJS.search('/' + path) and \
+                    os.path.exists(path[:-2] + '.c'):
+                yield path
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+
+    suffix = sys.argv[1] if len(sys.argv) > 1 else '.boundary'
+    objs = sys.argv[2:] or list(all_objects())
+
+    failed = 0
+    with Pool(cpu_count(), init_worker) as pool:
+        for obj, result in pool.imap_unordered(collect_one,
+                                               [(o, suffix) for o in objs], 16):
+            if result and result.startswith('failed'):
+                logging.error('%s: %s', obj, result)
+                failed += 1
+
+    sys.exit(1 if failed else 0)
@@ -42,7 +42,7 @@ class Extraction(object):
             self.dst_file = self.mod_dir + os.path.basename(src_file)
 
         if src_file in self.mod_hdrs:
-            file_name = tmp_dir + 'header_symbol.json'
+            file_name = tmp_dir + 'header_symbol/' + src_file + '.json'
         else:
             file_name = src_file + '.boundary'
 
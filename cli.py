@@ -5,20 +5,28 @@
 """cli.py - A command line interface for plugsched
 
 Usage:
-  plugsched-cli init        <release_kernel> <kernel_src> <work_dir>
-  plugsched-cli dev_init    <kernel_src> <work_dir>
+  plugsched-cli init        <release_kernel> <kernel_src> <work_dir> [--collector=<backend>]
+  plugsched-cli dev_init    <kernel_src> <work_dir> [--collector=<backend>]
   plugsched-cli extract_src <kernel_src_rpm> <target_dir>
-  plugsched-cli build       <work_dir>
+  plugsched-cli build       <work_dir> [--incremental] [--ccache]
+  plugsched-cli advise      <work_dir> [--top=<n>]
   plugsched-cli (-h | --help)
 
 Options:
-  -h --help     Show help.
+  -h --help                 Show help.
+  --collector=<backend>     How to collect source code information, gcc-plugin
+                            or dwarf (without gcc-python-plugin) [default: gcc-plugin].
+  --incremental             Reuse objects and packaging of the last build, skip
+                            packaging if none of the inputs changed.
+  --ccache                  Compile with ccache, the cache is in working/ccache.
+  --top=<n>                 Number of suggestions to show [default: 20].
 
 Available subcommands:
   init          Initialize a scheduler module for a specific kernel release and product
   dev_init      Initialize plugsched development envrionment from kernel source code
   extrat_src    extract kernel source code from kernel-src rpm
   build         Build a scheduler module rpm package for a specific kernel release and product
+  advise        Suggest interface changes that shrink the tainted functions
 
 Subcommand arguments:
   release_kernel      `uname -r` of target kernel to be hotpluged
@@ -42,6 +50,7 @@ from multiprocessing import cpu_count
 from tempfile import mkdtemp
 import colorlog
 import logging
+import hashlib
 import uuid
 import stat
 import os
@@ -65,11 +74,12 @@ logging.getLogger().addHandler(handler)
 logging.getLogger().addHandler(ShutdownHandler())
 
 class Plugsched(object):
-    def __init__(self, work_dir, vmlinux, makefile):
+    def __init__(self, work_dir, vmlinux, makefile, collector='gcc-plugin'):
         self.plugsched_path = os.path.dirname(os.path.realpath(__file__))
         self.work_dir = os.path.abspath(work_dir)
         self.vmlinux = os.path.abspath(vmlinux)
         self.makefile = os.path.abspath(makefile)
+        self.collector = collector
         self.mod_path = os.path.join(self.work_dir, 'kernel/sched/mod/')
         self.tmp_dir = os.path.join(self.work_dir, 'working/')
         plugsched_sh = sh(_cwd=self.plugsched_path)
@@ -77,7 +87,7 @@ class Plugsched(object):
         self.plugsched_sh, self.mod_sh = plugsched_sh, mod_sh
         self.get_kernel_version(self.makefile)
         self.get_config_dir()
-        self.search_springboard = sh.Command(self.plugsched_path + '/tools/springboard_search.sh')
+        self.search_springboard = sh.Command(self.plugsched_path + '/tools/springboard_search.py')
 
         with open(os.path.join(self.config_dir, 'boundary.yaml')) as f:
             self.config = load(f, Loader)
@@ -85,7 +95,7 @@ class Plugsched(object):
             self.config_dir + '/*':         self.tmp_dir,
             'boundary/*.py':                self.tmp_dir,
             'tools/symbol_resolve':         self.tmp_dir,
-            'tools/springboard_search.sh':  self.tmp_dir,
+            'tools/springboard_search.py':  self.tmp_dir,
             'src/Makefile.plugsched':       self.tmp_dir,
             'module-contrib/*':             self.tmp_dir,
             'src/*.[ch]':                   self.mod_path,
@@ -156,7 +166,8 @@ class Plugsched(object):
     def extract(self):
         logging.info('Extracting scheduler module objs: %s', ' '.join(self.mod_objs))
         self.mod_sh.make('olddefconfig')
-        self.make(stage = 'collect', plugsched_tmpdir = self.tmp_dir, plugsched_modpath = self.mod_path)
+        collect = 'collect_dwarf' if self.collector == 'dwarf' else 'collect'
+        self.make(stage = collect, plugsched_tmpdir = self.tmp_dir, plugsched_modpath = self.mod_path)
         self.make(stage = 'analyze', plugsched_tmpdir = self.tmp_dir, plugsched_modpath = self.mod_path)
         self.make(stage = 'extract', plugsched_tmpdir = self.tmp_dir, plugsched_modpath = self.mod_path,
                   objs = self.mod_objs)
@@ -199,7 +210,8 @@ class Plugsched(object):
             self.apply_patch('dynamic_springboard_2.patch')
 
         with open(os.path.join(self.mod_path, 'Makefile'), 'a') as f:
-            self.search_springboard('init', self.vmlinux, kernel_config, _out=f)
+            self.search_springboard('init', self.vmlinux, kernel_config,
+                                    os.path.join(self.tmp_dir, 'springboard_cache'), _out=f)
 
         logging.info("Succeed!")
 
@@ -215,16 +227,66 @@ class Plugsched(object):
         python_path += '/usr/local/lib/python' + py_ver + '/site-packages'
         os.environ["PYTHONPATH"] = python_path
 
-    def cmd_build(self):
+    def input_digest(self):
+        """Digest of everything that goes into the rpm package"""
+        files = ['.config', 'Module.symvers', 'vmlinux'] + self.sdcr_srcs
+        for r, dirs, fs in os.walk(self.mod_path):
+            files += [os.path.join(r, f) for f in fs
+                      if f.endswith(('.c', '.h', '.lds')) and not f.endswith('.mod.c')
+                      or f == 'Makefile']
+        for r in [self.tmp_dir, os.path.join(self.tmp_dir, 'symbol_resolve')]:
+            files += [os.path.join(r, f) for f in os.listdir(r)
+                      if os.path.isfile(os.path.join(r, f)) and
+                      not f.endswith(('.o', '.pyc')) and f != 'symbol_resolve']
+
+        digest = hashlib.sha256()
+        for f in sorted(os.path.relpath(f, self.work_dir) for f in files):
+            path = os.path.join(self.work_dir, f)
+            if not os.path.exists(path):
+                continue
+            digest.update(f.encode() + b'\0')
+            if f == 'vmlinux':
+                st = os.stat(path)
+                digest.update(('%d %d' % (st.st_size, st.st_mtime_ns)).encode())
+                continue
+            with open(path, 'rb') as fp:
+                digest.update(fp.read())
+        return digest.hexdigest()
+
+    def cmd_advise(self, top):
+        if not os.path.exists(self.work_dir):
+            logging.fatal("plugsched: Can't find %s", self.work_dir)
+        self.make(stage = 'advise', plugsched_tmpdir = self.tmp_dir, plugsched_modpath = self.mod_path,
+                  advise_top = top)
+
+    def cmd_build(self, incremental=False, use_ccache=False):
         if not os.path.exists(self.work_dir):
             logging.fatal("plugsched: Can't find %s", self.work_dir)
         self.add_python_path()
         logging.info("Preparing rpmbuild environment")
         rpmbuild_root = os.path.join(self.tmp_dir, 'rpmbuild')
-        self.mod_sh.rm(rpmbuild_root, recursive=True, force=True)
-        self.mod_sh.mkdir(rpmbuild_root)
+        digest_file = os.path.join(rpmbuild_root, 'input.digest')
+
+        if incremental:
+            digest = self.input_digest()
+            rpms = [f for f in glob('RPMS/*/*.rpm', rpmbuild_root) if os.path.exists(f)]
+            if rpms and os.path.exists(digest_file):
+                with open(digest_file) as f:
+                    if f.read() == digest:
+                        logging.info("Inputs unchanged, reuse %s", ' '.join(rpms))
+                        return
+        else:
+            self.mod_sh.rm(rpmbuild_root, recursive=True, force=True)
+
+        self.mod_sh.mkdir(rpmbuild_root, parents=True)
         rpmbase_sh = sh(_cwd=rpmbuild_root)
-        rpmbase_sh.mkdir(['BUILD','RPMS','SOURCES','SPECS','SRPMS'])
+        rpmbase_sh.mkdir(['BUILD','RPMS','SOURCES','SPECS','SRPMS'], parents=True)
+
+        defines = []
+        if use_ccache:
+            os.environ['CCACHE_DIR'] = os.path.join(self.tmp_dir, 'ccache')
+            os.environ['CCACHE_BASEDIR'] = self.work_dir
+            defines = ['--define', '_ccache 1']
 
         self.mod_sh.cp('working/scheduler.spec', os.path.join(rpmbuild_root, 'SPECS'), force=True)
         rpmbase_sh.rpmbuild('--define', '%%_topdir %s' % os.path.realpath(rpmbuild_root),
@@ -232,14 +294,23 @@ class Plugsched(object):
                             '--define', '%%_sdcrobjs "%s"' % ' '.join(self.sdcr_objs),
                             '--define', '%%KVER %s' % self.KVER,
                             '--define', '%%KREL %s' % self.KREL,
+                            *defines,
                             '-bb', 'SPECS/scheduler.spec',
                             _out=sys.stdout,
                             _err=sys.stderr)
+
+        # Digest again, the build itself generates some of the inputs
+        if incremental:
+            with open(digest_file, 'w') as f:
+                f.write(self.input_digest())
         logging.info("Succeed!")
 
 if __name__ == '__main__':
     arguments = docopt(__doc__)
 
+    if arguments['--collector'] not in ('gcc-plugin', 'dwarf'):
+        logging.fatal("Unknown collector %s", arguments['--collector'])
+
     if arguments['extract_src']:
         kernel_src_rpm = arguments['<kernel_src_rpm>']
         target_dir = arguments['<target_dir>']
@@ -278,7 +349,7 @@ if __name__ == '__main__':
         if not os.path.exists(kernel_config):
             logging.fatal("%s not found, please install kernel-devel-%s.rpm", kernel_config, release_kernel)
 
-        plugsched = Plugsched(work_dir, vmlinux, makefile)
+        plugsched = Plugsched(work_dir, vmlinux, makefile, arguments['--collector'])
         plugsched.cmd_init(kernel_src, sym_vers, kernel_config)
 
     elif arguments['dev_init']:
@@ -299,7 +370,7 @@ if __name__ == '__main__':
         if not os.path.exists(kernel_config):
             logging.fatal("kernel config %s not found", kernel_config)
 
-        plugsched = Plugsched(work_dir, vmlinux, makefile)
+        plugsched = Plugsched(work_dir, vmlinux, makefile, arguments['--collector'])
         plugsched.cmd_init(kernel_src, sym_vers, kernel_config)
 
     elif arguments['build']:
@@ -308,5 +379,13 @@ if __name__ == '__main__':
         vmlinux = os.path.join(work_dir, 'vmlinux')
         makefile = os.path.join(work_dir, 'Makefile')
         plugsched = Plugsched(work_dir, vmlinux, makefile)
-        plugsched.cmd_build()
+        plugsched.cmd_build(arguments['--incremental'], arguments['--ccache'])
+
+    elif arguments['advise']:
+        work_dir = arguments['<work_dir>']
+
+        vmlinux = os.path.join(work_dir, 'vmlinux')
+        makefile = os.path.join(work_dir, 'Makefile')
+        plugsched = Plugsched(work_dir, vmlinux, makefile)
+        plugsched.cmd_advise(arguments['--top'])
 
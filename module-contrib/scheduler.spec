@@ -21,6 +21,7 @@ BuildRequires:	elfutils-devel, elfutils-devel-static, elfutils-libelf-devel
 
 Requires:	systemd
 Requires:	binutils
+Requires:	python3
 
 %description
 The scheduler policy rpm-package.
@@ -30,6 +31,7 @@ The scheduler policy rpm-package.
 %build
 # Build sched_mod
 make KBUILD_MODPOST_WARN=1 \
+     %{?_ccache:CC="ccache gcc"} \
      plugsched_tmpdir=working \
      plugsched_modpath=%{_modpath} \
      sidecar_objs=%{?_sdcrobjs} \
@@ -37,7 +39,7 @@ make KBUILD_MODPOST_WARN=1 \
      plugsched -j $(nproc)
 
 # Build symbol resolve tool
-make -C working/symbol_resolve
+make -C working/symbol_resolve -j $(nproc)
 
 # Generate the tainted_functions file
 awk -F '[(,)]' '$2!=""{print $2" "$3" vmlinux"}' %{_modpath}/tainted_functions.h > working/tainted_functions
@@ -147,3 +147,21 @@ static void addr_sort(unsigned long *addr, unsigned long *size, int n) {
 		}
 	}
 }
+
+/*
+ * Entry of the task snapshot taken before stop_machine. Queued tasks are
+ * linked into the rebuild bucket of their cpu during stack check, so that
+ * clear_sched_state and rebuild_sched_state only visit their own tasks.
+ */
+struct task_node {
+	struct task_struct	*task;
+	struct llist_node	node;
+};
+
+struct rebuild_bucket {
+	struct llist_head	head;
+	/* Tasks taken off head by clear_sched_state, for rebuild_sched_state */
+	struct llist_node	*first;
+	/* Whether head holds all queued tasks of this cpu */
+	bool			valid;
+};
@@ -14,18 +14,19 @@
 #include <linux/version.h>
 #include "sched.h"
 #include "helper.h"
-#include "mempool.h"
 #include "head_jump.h"
+#include "metrics.h"
 #include "stack_check.h"
+/* After stack_check.h, extrapad walks the task snapshot */
+#include "mempool.h"
 
 #define CHECK_STACK_LAYOUT() \
 	BUILD_BUG_ON_MSG(MODULE_FRAME_POINTER != VMLINUX_FRAME_POINTER, \
 		"stack layout of __schedule can not match to it in vmlinux")
 
-#define MAX_CPU_NR		1024
-
 extern void __orig___schedule(bool);
-int process_id[MAX_CPU_NR];
+/* Dense ordinal of each online cpu, to partition work in stop_machine */
+DEFINE_PER_CPU(int, process_id);
 atomic_t cpu_finished;
 atomic_t clear_finished;
 atomic_t redirect_finished;
@@ -62,12 +63,24 @@ static struct dentry *sched_features_dir;
 static s64 stop_time;
 ktime_t stop_time_p0, stop_time_p1, stop_time_p2;
 ktime_t main_start, main_end, init_start, init_end;
+static s64 mempool_time;
 
 extern void clear_sched_state(bool mod);
 extern void rebuild_sched_state(bool mod);
 extern void switch_sched_class(bool mod);
 
 static int scheduler_enable = 0;
+/* Serialize switching and dry runs issued from sysfs */
+static DEFINE_MUTEX(plugsched_mutex);
+
+/* How many times a switch is retried after growing the mempools */
+#define MEMPOOL_GROW_RETRIES	3
+
+/* Load the module without switching, leave it to the enable interface */
+static bool defer_enable;
+module_param(defer_enable, bool, 0444);
+MODULE_PARM_DESC(defer_enable, "Don't switch to the new scheduler when loading");
+
 struct kobject *plugsched_dir, *plugsched_subdir, *vmlinux_moddir;
 
 struct tainted_function {
@@ -93,6 +106,7 @@ static inline void parallel_state_check_init(void)
 	atomic_set(&clear_finished, num_online_cpus());
 	atomic_set(&redirect_finished, num_online_cpus());
 	atomic_set(&global_error, 0);
+	stack_busy_reset();
 }
 
 static inline void process_id_init(void)
@@ -100,12 +114,12 @@ static inline void process_id_init(void)
 	int cpu, idx = 0;
 
 	for_each_online_cpu(cpu)
-		process_id[cpu] = idx++;
+		per_cpu(process_id, cpu) = idx++;
 }
 
 static bool is_first_process(void)
 {
-	return process_id[smp_processor_id()] == 0;
+	return this_cpu_read(process_id) == 0;
 }
 
 static void print_error(int error)
@@ -115,6 +129,9 @@ static void print_error(int error)
 			printk("scheduler: Error: not enough memory for mempool!\n");
 		} else if(error == -EBUSY) {
 			printk("scheduler: Error: Device or resources busy!\n");
+			printk("scheduler: Error: task %s(%d) is running in %pS\n",
+					stack_busy.comm, stack_busy.pid,
+					(void *)stack_busy.addr);
 		} else {
 			printk("scheduler: Error: Unknown\n");
 		}
@@ -154,6 +171,7 @@ static void disable_stack_protector(void) { }
 static int __sync_sched_install(void *arg)
 {
 	int error;
+	ktime_t rebuild_start;
 
 	if (is_first_process()) {
 		stop_time_p0 = ktime_get();
@@ -178,10 +196,9 @@ static int __sync_sched_install(void *arg)
 		return error;
 	}
 
-	if (is_first_process()) {
-		sched_alloc_extrapad();
+	sched_alloc_extrapad(this_cpu_read(process_id), num_online_cpus());
+	if (is_first_process())
 		stop_time_p1 = ktime_get();
-	}
 
 	clear_sched_state(false);
 	atomic_dec(&clear_finished);
@@ -197,7 +214,9 @@ static int __sync_sched_install(void *arg)
 
 	atomic_dec(&redirect_finished);
 	atomic_cond_read_relaxed(&redirect_finished, !VAL);
+	rebuild_start = ktime_get();
 	rebuild_sched_state(true);
+	this_cpu_write(rebuild_time, ktime_to_ns(ktime_sub(ktime_get(), rebuild_start)));
 
 	if (is_first_process())
 		stop_time_p2 = ktime_get();
@@ -208,6 +227,7 @@ static int __sync_sched_install(void *arg)
 static int __sync_sched_restore(void *arg)
 {
 	int error;
+	ktime_t rebuild_start;
 
 	if (is_first_process())
 		stop_time_p0 = ktime_get();
@@ -243,12 +263,13 @@ static int __sync_sched_restore(void *arg)
 
 	atomic_dec(&redirect_finished);
 	atomic_cond_read_relaxed(&redirect_finished, !VAL);
+	rebuild_start = ktime_get();
 	rebuild_sched_state(false);
+	this_cpu_write(rebuild_time, ktime_to_ns(ktime_sub(ktime_get(), rebuild_start)));
 
-	if (is_first_process()) {
-		sched_free_extrapad();
+	sched_free_extrapad(this_cpu_read(process_id), num_online_cpus());
+	if (is_first_process())
 		stop_time_p2 = ktime_get();
-	}
 
 	return 0;
 }
@@ -386,13 +407,39 @@ static void report_detail_time(char *ops)
 			ktime_to_ns(ktime_sub(stop_time_p2, stop_time_p0)));
 	printk("scheduler %s: %-25s %12lld ns\n", ops, "stack check time is",
 			ktime_to_ns(ktime_sub(stop_time_p1, stop_time_p0)));
+	printk("scheduler %s: %-25s %12lld ns\n", ops, "stack check cpu max is",
+			max_percpu_time(&stack_check_time));
+	printk("scheduler %s: %-25s %12lld ns\n", ops, "dequeue cpu max is",
+			max_percpu_time(&dequeue_time));
+	printk("scheduler %s: %-25s %12lld ns\n", ops, "enqueue cpu max is",
+			max_percpu_time(&enqueue_time));
+	printk("scheduler %s: %-25s %12lld ns\n", ops, "bandwidth cpu max is",
+			max_percpu_time(&bandwidth_time));
 	printk("scheduler %s: %-25s %12lld ns\n", ops, "all the time is",
 			ktime_to_ns(ktime_sub(main_end, main_start)));
 }
 
+static void update_switch_metrics(struct switch_metrics *m)
+{
+	metric_update(m, PHASE_STOP_MACHINE, stop_time);
+	metric_update(m, PHASE_STOP_HANDLER,
+			ktime_to_ns(ktime_sub(stop_time_p2, stop_time_p0)));
+	metric_update(m, PHASE_STACK_CHECK,
+			ktime_to_ns(ktime_sub(stop_time_p1, stop_time_p0)));
+	metric_update(m, PHASE_STACK_CHECK_CPU_MAX,
+			max_percpu_time(&stack_check_time));
+	metric_update(m, PHASE_REBUILD, max_percpu_time(&rebuild_time));
+	metric_update(m, PHASE_DEQUEUE_CPU_MAX, max_percpu_time(&dequeue_time));
+	metric_update(m, PHASE_ENQUEUE_CPU_MAX, max_percpu_time(&enqueue_time));
+	metric_update(m, PHASE_BANDWIDTH_CPU_MAX, max_percpu_time(&bandwidth_time));
+	metric_update(m, PHASE_TOTAL, ktime_to_ns(ktime_sub(main_end, main_start)));
+	m->success++;
+}
+
 static int load_sched_routine(void)
 {
-	int ret;
+	int ret, grow_retries = 0;
+	ktime_t grow_start;
 
 	/* Add refcnt to avoid rmmod before disable. */
 	__module_get(THIS_MODULE);
@@ -402,18 +449,38 @@ static int load_sched_routine(void)
 
 	if (sched_mempools_create()) {
 		printk("scheduler: Error: create mempools failed!\n");
+		load_metrics.failures++;
 		module_put(THIS_MODULE);
 		return -ENOMEM;
 	}
+	mempool_time = ktime_to_ns(ktime_sub(ktime_get(), main_start));
 
+retry:
+	task_snapshot_create();
 	cpu_maps_update_begin();
 	parallel_state_check_init();
 	process_id_init();
 
 	ret = sync_sched_mod(__sync_sched_install);
 	cpu_maps_update_done();
+	task_snapshot_destroy();
+
+	/* Tasks or cgroups were created after the mempools were sized */
+	if (ret == -ENOMEM && grow_retries++ < MEMPOOL_GROW_RETRIES) {
+		load_metrics.failures++;
+		grow_start = ktime_get();
+		if (!sched_mempools_grow()) {
+			mempool_time += ktime_to_ns(ktime_sub(ktime_get(), grow_start));
+			goto retry;
+		}
+		printk("scheduler: Error: grow mempools failed!\n");
+		module_put(THIS_MODULE);
+		return -ENOMEM;
+	}
+
 	if (ret) {
 		sched_mempools_destroy();
+		load_metrics.failures++;
 		module_put(THIS_MODULE);
 		return ret;
 	}
@@ -429,6 +496,8 @@ static int load_sched_routine(void)
 
 	main_end = ktime_get();
 	report_detail_time("load");
+	metric_update(&load_metrics, PHASE_MEMPOOL_CREATE, mempool_time);
+	update_switch_metrics(&load_metrics);
 	scheduler_enable = 1;
 
 	return 0;
@@ -441,14 +510,18 @@ static int unload_sched_routine(void)
 	printk("scheduler module is unloading\n");
 	main_start = ktime_get();
 
+	task_snapshot_create();
 	cpu_maps_update_begin();
 	parallel_state_check_init();
 	process_id_init();
 
 	ret = sync_sched_mod(__sync_sched_restore);
 	cpu_maps_update_done();
-	if (ret)
+	task_snapshot_destroy();
+	if (ret) {
+		unload_metrics.failures++;
 		return ret;
+	}
 
 #ifdef CONFIG_SCHEDSTATS
 	restore_proc_schedstat();
@@ -462,6 +535,7 @@ static int unload_sched_routine(void)
 	sched_mempools_destroy();
 	main_end = ktime_get();
 	report_detail_time("unload");
+	update_switch_metrics(&unload_metrics);
 
 	module_put(THIS_MODULE);
 	scheduler_enable = 0;
@@ -481,13 +555,14 @@ static ssize_t plugsched_enabled_store(struct kobject *kobj,
 
 	val = !!val;
 
+	mutex_lock(&plugsched_mutex);
 	if (scheduler_enable == val)
-		return count;
-
-	if (val)
+		ret = 0;
+	else if (val)
 		ret = load_sched_routine();
 	else
 		ret = unload_sched_routine();
+	mutex_unlock(&plugsched_mutex);
 
 	if (ret)
 		return ret;
@@ -501,9 +576,80 @@ static ssize_t plugsched_enable_show(struct kobject *kobj,
 	return sprintf(buf, "%d\n", scheduler_enable);
 }
 
+static ssize_t plugsched_mempool_show(struct kobject *kobj,
+		struct kobj_attribute *attr, char *buf)
+{
+	ssize_t len = 0;
+
+	/* Mempools only exist while the scheduler is enabled */
+	mutex_lock(&plugsched_mutex);
+	if (scheduler_enable)
+		len = sched_mempools_show(buf);
+	mutex_unlock(&plugsched_mutex);
+
+	return len;
+}
+
+static struct kobj_attribute plugsched_mempool_attr =
+	__ATTR(mempool, 0444, plugsched_mempool_show, NULL);
+
 static struct kobj_attribute plugsched_enable_attr =
 	__ATTR(enable, 0644, plugsched_enable_show, plugsched_enabled_store);
 
+static ssize_t plugsched_busy_show(struct kobject *kobj,
+		struct kobj_attribute *attr, char *buf)
+{
+	return stack_busy_show(buf);
+}
+
+static struct kobj_attribute plugsched_busy_attr =
+	__ATTR(busy, 0444, plugsched_busy_show, NULL);
+
+static ssize_t plugsched_dry_run_store(struct kobject *kobj,
+		struct kobj_attribute *attr, const char *buf, size_t count)
+{
+	int ret;
+	unsigned long val;
+
+	ret = kstrtoul(buf, 10, &val);
+	if (ret)
+		return ret;
+
+	if (!val)
+		return count;
+
+	/* Check against the functions the next switch would redirect */
+	mutex_lock(&plugsched_mutex);
+	ret = stack_check_dry_run(!scheduler_enable);
+	mutex_unlock(&plugsched_mutex);
+
+	if (ret)
+		return ret;
+
+	return count;
+}
+
+static ssize_t plugsched_dry_run_show(struct kobject *kobj,
+		struct kobj_attribute *attr, char *buf)
+{
+	return stack_dry_run_show(buf);
+}
+
+static struct kobj_attribute plugsched_dry_run_attr =
+	__ATTR(dry_run, 0644, plugsched_dry_run_show, plugsched_dry_run_store);
+
+static struct attribute *plugsched_attrs[] = {
+	&plugsched_enable_attr.attr,
+	&plugsched_busy_attr.attr,
+	&plugsched_dry_run_attr.attr,
+	&plugsched_mempool_attr.attr,
+	NULL,
+};
+
+static const struct attribute_group plugsched_attr_group = {
+	.attrs = plugsched_attrs,
+};
+
 static int register_plugsched_enable(void)
 {
 	int ret = -ENOMEM;
@@ -520,7 +666,7 @@ static int register_plugsched_enable(void)
 	if (!vmlinux_moddir)
 		goto error;
 
-	ret = sysfs_create_file(plugsched_subdir, &plugsched_enable_attr.attr);
+	ret = sysfs_create_group(plugsched_subdir, &plugsched_attr_group);
 	if (ret)
 		goto error;
 
@@ -535,7 +681,7 @@ error:
 
 static void unregister_plugsched_enable(void)
 {
-	sysfs_remove_file(plugsched_subdir, &plugsched_enable_attr.attr);
+	sysfs_remove_group(plugsched_subdir, &plugsched_attr_group);
 	kobject_put(vmlinux_moddir);
 	kobject_put(plugsched_subdir);
 	kobject_put(plugsched_dir);
@@ -568,6 +714,7 @@ static void unregister_tainted_functions(void)
 static inline void unregister_plugsched_sysfs(void)
 {
 	unregister_tainted_functions();
+	unregister_plugsched_metrics();
 	unregister_plugsched_enable();
 }
 
@@ -578,6 +725,12 @@ static int register_plugsched_sysfs(void)
 		return -ENOMEM;
 	}
 
+	if (register_plugsched_metrics(plugsched_subdir)) {
+		printk("scheduler: Error: Register plugsched metrics failed!\n");
+		unregister_plugsched_sysfs();
+		return -ENOMEM;
+	}
+
 	if (register_tainted_functions()) {
 		printk("scheduler: Error: Register taint functions failed!\n");
 		unregister_plugsched_sysfs();
@@ -612,7 +765,13 @@ static int __init sched_mod_init(void)
 	printk("scheduler: total initialization time is %14lld ns\n",
 			ktime_to_ns(ktime_sub(init_end, init_start)));;
 
+	if (defer_enable)
+		return 0;
+
+	/* sysfs is live already, don't race with enable or dry_run writes */
+	mutex_lock(&plugsched_mutex);
 	ret = load_sched_routine();
+	mutex_unlock(&plugsched_mutex);
 	if (ret)
 		unregister_plugsched_sysfs();
 
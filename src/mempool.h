@@ -6,69 +6,169 @@
 #ifdef SCHEDMOD_MEMPOOL
 
 #include <linux/percpu.h>
+#include <linux/sort.h>
+#include <linux/atomic.h>
 
-#define is_simple_mempool_addr(smpool, addr) \
-	((unsigned long)(addr) >= (smpool)->vstart && \
-	 (unsigned long)(addr) <= (smpool)->vend)
-
-struct simple_mempool {
+/* One chunk of a simple mempool, backed by memory of its node. */
+struct simple_mempool_node {
 	unsigned long		vstart;
 	unsigned long		vend;
-	unsigned long		alloc_addr;
+	/* Allocated by all cpus of the stop_machine handler at once. */
+	atomic_long_t		alloc_addr;
+	unsigned int		obj_num;
+};
+
+struct simple_mempool {
 	unsigned int 		obj_size;
 	unsigned int		obj_num;
+	/* Indexed by node id, nodes without cpus have no chunk. */
+	struct simple_mempool_node *nodes;
 };
 
 struct simple_percpu_mempool {
 	/* The base address of each percpu memory area. */
 	unsigned long		*percpu_ptr;
-	/* Record the areas' allocated size. */
-	unsigned long		allocated_size;
+	/* Area base addresses in ascending order, for address lookup. */
+	unsigned long		*sorted_ptr;
+	/* Index of the next obj, across all areas. */
+	atomic_long_t		alloc_idx;
 	unsigned int		obj_size;
 	/* How many areas are required for the mempool. */
 	unsigned int		areas;
 	/* How many objs can be assigned from each area. */
 	unsigned int		objs_per_area;
-	/* Used to record which area is allocated from. */
-	unsigned int		area_id;
 };
 
-static inline void *simple_mempool_alloc(struct simple_mempool *smpool)
+/* O(nr_node_ids) regardless of the number of objects */
+static inline bool is_simple_mempool_addr(struct simple_mempool *smpool,
+		void *_addr)
+{
+	unsigned long addr = (unsigned long)_addr;
+	int node;
+
+	for (node = 0; node < nr_node_ids; node++) {
+		if (addr >= smpool->nodes[node].vstart &&
+		    addr < smpool->nodes[node].vend)
+			return true;
+	}
+
+	return false;
+}
+
+static void *simple_mempool_node_alloc(struct simple_mempool_node *smnode,
+		unsigned int obj_size)
+{
+	unsigned long addr;
+
+	do {
+		addr = atomic_long_read(&smnode->alloc_addr);
+		if (addr + obj_size > smnode->vend)
+			return NULL;
+	} while (atomic_long_cmpxchg(&smnode->alloc_addr, addr,
+				addr + obj_size) != addr);
+
+	return (void *)addr;
+}
+
+/* Allocate from node, or from the following nodes once it runs out */
+static inline void *simple_mempool_alloc(struct simple_mempool *smpool,
+		int node)
 {
 	void *ret;
+	int i;
+
+	if (node < 0 || node >= nr_node_ids)
+		node = 0;
 
-	ret = smpool->alloc_addr;
-	smpool->alloc_addr += smpool->obj_size;
+	for (i = 0; i < nr_node_ids; i++) {
+		ret = simple_mempool_node_alloc(
+				&smpool->nodes[(node + i) % nr_node_ids],
+				smpool->obj_size);
+		if (ret)
+			return ret;
+	}
 
-	return ret;
+	return NULL;
 }
 
+static inline void simple_mempool_destory(struct simple_mempool *smpool)
+{
+	int node;
+
+	for (node = 0; node < nr_node_ids; node++)
+		vfree((void *)smpool->nodes[node].vstart);
+	kfree(smpool->nodes);
+	kfree(smpool);
+}
+
+/*
+ * Split obj_num among nodes by their share of the cpus in the node masks,
+ * rounding up, so the sum covers obj_num. A node running out falls back
+ * to the others.
+ */
 static inline struct simple_mempool *simple_mempool_create(int obj_num, int obj_size)
 {
+	struct simple_mempool_node *smnode;
 	struct simple_mempool *smpool;
+	unsigned int cpus = 0;
+	int node;
+
+	/* Not num_possible_cpus(), the node masks may hold online cpus only */
+	for_each_node(node)
+		cpus += nr_cpus_node(node);
 
 	smpool = kzalloc_node(sizeof(*smpool), GFP_ATOMIC, 0);
 	if (!smpool)
 		return NULL;
 
-	smpool->vstart = vmalloc_node(obj_num * obj_size, 0);
-	if (!smpool->vstart) {
+	smpool->nodes = kcalloc(nr_node_ids, sizeof(*smpool->nodes), GFP_ATOMIC);
+	if (!smpool->nodes) {
 		kfree(smpool);
 		return NULL;
 	}
 
-	smpool->alloc_addr = smpool->vstart;
-	smpool->vend = smpool->vstart + obj_num * obj_size;
+	for_each_node(node) {
+		smnode = &smpool->nodes[node];
+		if (cpus)
+			smnode->obj_num = DIV_ROUND_UP((u64)obj_num * nr_cpus_node(node), cpus);
+		else
+			smnode->obj_num = node == first_online_node ? obj_num : 0;
+		if (!smnode->obj_num)
+			continue;
+
+		smnode->vstart = (unsigned long)vmalloc_node(
+				(unsigned long)smnode->obj_num * obj_size, node);
+		if (!smnode->vstart) {
+			simple_mempool_destory(smpool);
+			return NULL;
+		}
+
+		atomic_long_set(&smnode->alloc_addr, smnode->vstart);
+		smnode->vend = smnode->vstart + (unsigned long)smnode->obj_num * obj_size;
+		smpool->obj_num += smnode->obj_num;
+	}
+
 	smpool->obj_size = obj_size;
-	smpool->obj_num = obj_num;
 
 	return smpool;
 }
 
-static inline void simple_mempool_destory(struct simple_mempool *smpool)
+static inline unsigned long simple_mempool_node_used(
+		struct simple_mempool *smpool, int node)
 {
-	vfree(smpool->vstart);
-	kfree(smpool);
+	struct simple_mempool_node *smnode = &smpool->nodes[node];
+
+	if (!smnode->vstart)
+		return 0;
+	return (atomic_long_read(&smnode->alloc_addr) - smnode->vstart) /
+		smpool->obj_size;
+}
+
+static int cmp_percpu_area(const void *a, const void *b)
+{
+	unsigned long x = *(unsigned long *)a, y = *(unsigned long *)b;
+
+	return x < y ? -1 : x > y;
 }
 
 static struct simple_percpu_mempool *simple_percpu_mempool_create(int obj_num,
@@ -88,7 +188,9 @@ static struct simple_percpu_mempool *simple_percpu_mempool_create(int obj_num,
 
 	psmpool->percpu_ptr =
 		kzalloc_node(sizeof(unsigned long) * areas, GFP_ATOMIC, 0);
-	if (!psmpool->percpu_ptr)
+	psmpool->sorted_ptr =
+		kzalloc_node(sizeof(unsigned long) * areas, GFP_ATOMIC, 0);
+	if (!psmpool->percpu_ptr || !psmpool->sorted_ptr)
 		goto error;
 
 	for (cnt = 0; cnt < areas; cnt++) {
@@ -99,6 +201,11 @@ static struct simple_percpu_mempool *simple_percpu_mempool_create(int obj_num,
 		psmpool->percpu_ptr[cnt] = (unsigned long)ptr;
 	}
 
+	memcpy(psmpool->sorted_ptr, psmpool->percpu_ptr,
+			sizeof(unsigned long) * areas);
+	sort(psmpool->sorted_ptr, areas, sizeof(unsigned long),
+			cmp_percpu_area, NULL);
+
 	psmpool->obj_size = obj_size;
 	psmpool->objs_per_area = objs_per_area;
 	psmpool->areas = areas;
@@ -109,6 +216,7 @@ error:
 	while (cnt > 0)
 		free_percpu((void *)psmpool->percpu_ptr[--cnt]);
 
+	kfree(psmpool->sorted_ptr);
 	kfree(psmpool->percpu_ptr);
 	kfree(psmpool);
 
@@ -117,19 +225,12 @@ error:
 
 static void *simple_percpu_mempool_alloc(struct simple_percpu_mempool *psmpool)
 {
-	unsigned long area_size, ret;
+	unsigned long idx;
 
-	area_size = psmpool->obj_size * psmpool->objs_per_area;
+	idx = atomic_long_inc_return(&psmpool->alloc_idx) - 1;
 
-	if ((psmpool->allocated_size + psmpool->obj_size) > area_size) {
-		psmpool->area_id++;
-		psmpool->allocated_size = 0;
-	}
-
-	ret = psmpool->percpu_ptr[psmpool->area_id] + psmpool->allocated_size;
-	psmpool->allocated_size += psmpool->obj_size;
-
-	return (void *)ret;
+	return (void *)(psmpool->percpu_ptr[idx / psmpool->objs_per_area] +
+			idx % psmpool->objs_per_area * psmpool->obj_size);
 }
 
 static void simple_percpu_mempool_destory(struct simple_percpu_mempool *psmpool)
@@ -139,31 +240,68 @@ static void simple_percpu_mempool_destory(struct simple_percpu_mempool *psmpool)
 	for (i = 0; i < psmpool->areas; i++)
 		free_percpu((void *)psmpool->percpu_ptr[i]);
 
+	kfree(psmpool->sorted_ptr);
 	kfree(psmpool->percpu_ptr);
 	kfree(psmpool);
 }
 
+/* Find the last area starting at or below addr, then check its end. */
 static inline bool is_simple_percpu_mempool_addr(
 		struct simple_percpu_mempool *psmpool, void *_addr)
 {
 	int i;
-	unsigned long addr, area_size, base;
+	unsigned long addr, area_size;
 
 	addr = (unsigned long)_addr;
 	area_size = psmpool->obj_size * psmpool->objs_per_area;
 
-	for (i = 0; i < psmpool->areas; i++) {
-		base = psmpool->percpu_ptr[i];
-		if (addr >= base && addr < (base + area_size))
-			return true;
-	}
+	i = bsearch(psmpool->sorted_ptr, 0, psmpool->areas - 1, addr);
+	if (i < 0)
+		return false;
 
-	return false;
+	return addr < psmpool->sorted_ptr[i] + area_size;
 }
 
 #define FIELD_TYPE(t, f) typeof(((struct t*)0)->f)
 #define FIELD_INDIRECT_TYPE(t, f) typeof(*((struct t*)0)->f)
 
+/* Extra objects reserved beyond require, in percent */
+static unsigned int mempool_headroom = 10;
+module_param(mempool_headroom, uint, 0644);
+MODULE_PARM_DESC(mempool_headroom, "Extra percent of objects reserved by mempools");
+
+/*
+ * require and max are evaluated when the pool is created, so the pool is
+ * sized from the task and cgroup counts of that moment plus the headroom.
+ */
+static inline unsigned long mempool_size(unsigned long require,
+		unsigned long max)
+{
+	return max_t(unsigned long, max,
+			require + require * mempool_headroom / 100);
+}
+
+struct sched_mempool {
+	const char	*name;
+	int		(*create)(void);
+	void		(*destroy)(void);
+	int		(*recheck)(void);
+	void		(*usage)(unsigned long *used, unsigned long *total);
+	/* Per node usage, NULL for percpu mempools */
+	void		(*node_usage)(int node, unsigned long *used,
+				      unsigned long *total);
+};
+
+#define DEFINE_SCHED_MEMPOOL(name, node_usage_fn)			\
+static struct sched_mempool name##_mempool = {				\
+	.name		= #name,					\
+	.create		= create_mempool_##name,			\
+	.destroy	= destroy_mempool_##name,			\
+	.recheck	= recheck_mempool_##name,			\
+	.usage		= usage_mempool_##name,				\
+	.node_usage	= node_usage_fn,				\
+}
+
 #define DEFINE_RESERVE(type, field, name, require, max)			\
 static struct simple_mempool *name##_smp = NULL;			\
 static void release_##name##_reserve(struct type *x)			\
@@ -172,24 +310,46 @@ static void release_##name##_reserve(struct type *x)			\
 		kfree(x->field);					\
 	x->field = NULL;						\
 }									\
-static FIELD_TYPE(type, field) alloc_##name##_reserve(void)		\
+static FIELD_TYPE(type, field) alloc_##name##_reserve(int node)		\
 {									\
-	return simple_mempool_alloc(name##_smp);			\
+	return simple_mempool_alloc(name##_smp, node);			\
 }									\
 static int create_mempool_##name(void)					\
 {									\
-	name##_smp = simple_mempool_create(max,				\
+	name##_smp = simple_mempool_create(mempool_size(require, max),	\
 			sizeof(FIELD_INDIRECT_TYPE(type, field)));	\
 	if (!name##_smp)						\
 		return -ENOMEM;						\
 	return 0;							\
 }									\
+static void destroy_mempool_##name(void)				\
+{									\
+	simple_mempool_destory(name##_smp);				\
+	name##_smp = NULL;						\
+}									\
 static int recheck_mempool_##name(void)					\
 {									\
 	if (require > name##_smp->obj_num)				\
 		return -ENOMEM;						\
 	return 0;							\
-}
+}									\
+static void usage_mempool_##name(unsigned long *used,			\
+		unsigned long *total)					\
+{									\
+	int node;							\
+									\
+	*used = 0;							\
+	for (node = 0; node < nr_node_ids; node++)			\
+		*used += simple_mempool_node_used(name##_smp, node);	\
+	*total = name##_smp->obj_num;					\
+}									\
+static void node_usage_mempool_##name(int node, unsigned long *used,	\
+		unsigned long *total)					\
+{									\
+	*used = simple_mempool_node_used(name##_smp, node);		\
+	*total = name##_smp->nodes[node].obj_num;			\
+}									\
+DEFINE_SCHED_MEMPOOL(name, node_usage_mempool_##name)
 
 #define DEFINE_RESERVE_PERCPU(type, field, name, require, max)		\
 static struct simple_percpu_mempool *name##_smp = NULL;			\
@@ -205,18 +365,31 @@ static FIELD_TYPE(type, field) alloc_##name##_reserve(void)		\
 }									\
 static int create_mempool_##name(void)					\
 {									\
-	name##_smp = simple_percpu_mempool_create(max,			\
+	name##_smp = simple_percpu_mempool_create(			\
+			mempool_size(require, max),			\
 			sizeof(FIELD_INDIRECT_TYPE(type, field)));	\
 	if (!name##_smp)						\
 		return -ENOMEM;						\
 	return 0;							\
 }									\
+static void destroy_mempool_##name(void)				\
+{									\
+	simple_percpu_mempool_destory(name##_smp);			\
+	name##_smp = NULL;						\
+}									\
 static int recheck_mempool_##name(void) 				\
 {									\
 	if (require > (name##_smp->areas * name##_smp->objs_per_area))	\
 		return -ENOMEM;						\
 	return 0;							\
-}
+}									\
+static void usage_mempool_##name(unsigned long *used,			\
+		unsigned long *total)					\
+{									\
+	*used = atomic_long_read(&name##_smp->alloc_idx);		\
+	*total = name##_smp->areas * name##_smp->objs_per_area;		\
+}									\
+DEFINE_SCHED_MEMPOOL(name, NULL)
 
 /*
  * Examples of simple mempool usage
@@ -242,117 +415,208 @@ static int recheck_mempool_##name(void) 				\
  * 		nr_threads + nr_cpu_ids)// we alloc nr_cpu_ids objects before stop_machine
  */
 
-static int sched_mempools_create(void)
-{
-	int err;
-
-	/*
-	 * Examples of mempools create
-	 * if ((err = create_mempool_se()))
-	 * 	return err;
-
-	 * if ((err = create_mempool_rq()))
-	 * 	return err;
+/*
+ * All mempools, created, rechecked and destroyed in this order.
+ *
+ * Examples of mempools registration
+ * &se_mempool,
+ * &rq_mempool,
+ * &percpu_var_mempool,
+ */
+static struct sched_mempool *sched_mempools[] = {
+	NULL,
+};
 
-	 * if (err = create_mempool_percpu_var())
-	 * 	return err;
-	 */
+static void sched_mempools_destroy(void)
+{
+	struct sched_mempool **smp;
 
-	return 0;
+	for (smp = sched_mempools; *smp; smp++)
+		(*smp)->destroy();
 }
 
-static void sched_mempools_destroy(void)
+static int sched_mempools_create(void)
 {
-	/*
-	 * Examples of mempools destroy
-	 * simple_mempool_destory(se_smp);
-	 * simple_mempool_destory(rq_smp);
-	 * simple_percpu_mempool_destory(percpu_var_smp);
-	 */
+	struct sched_mempool **smp;
+
+	for (smp = sched_mempools; *smp; smp++) {
+		if ((*smp)->create()) {
+			while (smp-- != sched_mempools)
+				(*smp)->destroy();
+			return -ENOMEM;
+		}
+	}
+
+	return 0;
 }
 
 static int recheck_smps(void)
 {
-	int err = -ENOMEM;
+	struct sched_mempool **smp;
+	int err;
 
-	/*
-	 * Examples of mempools recheck
-	 * if ((err = recheck_mempool_rq()))
-	 * 	return err;
+	for (smp = sched_mempools; *smp; smp++) {
+		if ((err = (*smp)->recheck()))
+			return err;
+	}
 
-	 * if ((err = recheck_mempool_se()))
-	 * 	return err;
+	return 0;
+}
 
-	 * if ((err = recheck_mempool_percpu_var()))
-	 *	return err;
-	 */
+/*
+ * The system grew after the mempools were created, recreate the pools
+ * that are too small from the current counts. Must be called outside
+ * stop_machine, before any object is allocated from the pools. All pools
+ * are destroyed on failure.
+ */
+static int sched_mempools_grow(void)
+{
+	struct sched_mempool **smp, **failed;
+
+	for (smp = sched_mempools; *smp; smp++) {
+		if (!(*smp)->recheck())
+			continue;
+
+		printk("scheduler: mempool %s is too small, growing it\n",
+				(*smp)->name);
+		(*smp)->destroy();
+		if ((*smp)->create()) {
+			/* Destroy all the other pools, as sched_mempools_create does */
+			for (failed = smp, smp = sched_mempools; *smp; smp++) {
+				if (smp != failed)
+					(*smp)->destroy();
+			}
+			return -ENOMEM;
+		}
+	}
 
 	return 0;
 }
 
-static void sched_alloc_extrapad(void)
+/* Utilisation of each mempool, valid while the scheduler is enabled */
+static ssize_t sched_mempools_show(char *buf)
 {
-	/* TODO: Exploit all CPUs */
+	struct sched_mempool **smp;
+	unsigned long used, total;
+	ssize_t len = 0;
+	int node;
+
+	for (smp = sched_mempools; *smp; smp++) {
+		(*smp)->usage(&used, &total);
+		len += scnprintf(buf + len, PAGE_SIZE - len, "%s %lu %lu",
+				(*smp)->name, used, total);
+		for (node = 0; (*smp)->node_usage && node < nr_node_ids; node++) {
+			(*smp)->node_usage(node, &used, &total);
+			if (total)
+				len += scnprintf(buf + len, PAGE_SIZE - len,
+						" node%d %lu/%lu", node, used, total);
+		}
+		len += scnprintf(buf + len, PAGE_SIZE - len, "\n");
+	}
 
+	return len;
+}
+
+/*
+ * Called by every cpu in the stop_machine handler. Like stack_check, each
+ * cpu takes its slice of the task snapshot, and the runqueues whose cpu
+ * % nr == id. If the snapshot went stale, cpu 0 walks all threads. Task
+ * groups are few, the last cpu takes them all. The mempools can be
+ * allocated from concurrently.
+ */
+static void sched_alloc_extrapad(int id, int nr)
+{
 	/*
 	 * Examples of alloc extrapad
 	 * struct task_struct *p, *t;
 	 * struct task_group *tg;
+	 * u64 i, end;
 	 * int cpu;
 
 	 * for_each_possible_cpu(cpu) {
-	 * 	cpu_rq(cpu)->bvt = alloc_rq_reserve();
-	 * 	idle_task(cpu)->se.statistics.bvt = alloc_se_reserve();
+	 * 	if (cpu % nr != id)
+	 * 		continue;
+	 * 	cpu_rq(cpu)->bvt = alloc_rq_reserve(cpu_to_node(cpu));
+	 * 	idle_task(cpu)->se.statistics.bvt =
+	 * 		alloc_se_reserve(cpu_to_node(cpu));
 	 * }
 
-	 * for_each_process_thread(p, t)
-	 * 	t->se.statistics.bvt = alloc_se_reserve();
+	 * if (task_snapshot_valid()) {
+	 * 	end = (u64)nr_snapshot * (id + 1) / nr;
+	 * 	for (i = (u64)nr_snapshot * id / nr; i < end; i++) {
+	 * 		t = task_snapshot[i].task;
+	 * 		t->se.statistics.bvt =
+	 * 			alloc_se_reserve(cpu_to_node(task_cpu(t)));
+	 * 		t->percpu_var = alloc_percpu_var_reserve();
+	 * 	}
+	 * } else if (id == 0) {
+	 * 	for_each_process_thread(p, t) {
+	 * 		t->se.statistics.bvt =
+	 * 			alloc_se_reserve(cpu_to_node(task_cpu(t)));
+	 * 		t->percpu_var = alloc_percpu_var_reserve();
+	 * 	}
+	 * }
 
+	 * if (id != nr - 1)
+	 * 	return;
 	 * list_for_each_entry_rcu(tg, &task_groups, list) {
 	 * 	if (tg == &root_task_group || task_group_is_autogroup(tg))
 	 *		continue;
 	 * 	for_each_possible_cpu(cpu)
-	 * 		tg->se[cpu]->statistics.bvt = alloc_se_reserve();
+	 * 		tg->se[cpu]->statistics.bvt =
+	 * 			alloc_se_reserve(cpu_to_node(cpu));
 	 * }
-
-	 * for_each_process_thread (p, t)
-	 *	t->percpu_var = alloc_percpu_var_reserve();
 	 */
 }
 
-static void sched_free_extrapad(void)
+/* Called by every cpu, partitioned the same way as sched_alloc_extrapad */
+static void sched_free_extrapad(int id, int nr)
 {
-	/* TODO: Exploit all CPUs */
-
 	/*
 	 * Examples of free extrapad
 	 * struct task_struct *p, *t;
 	 * struct task_group *tg;
+	 * u64 i, end;
 	 * int cpu;
 
 	 * for_each_possible_cpu(cpu) {
+	 * 	if (cpu % nr != id)
+	 * 		continue;
 	 * 	release_se_reserve(&idle_task(cpu)->se.statistics);
 	 * 	release_rq_reserve(cpu_rq(cpu));
 	 * }
-	 * for_each_process_thread (p, t)
-	 * 	release_se_reserve(&t->se.statistics);
 
+	 * if (task_snapshot_valid()) {
+	 * 	end = (u64)nr_snapshot * (id + 1) / nr;
+	 * 	for (i = (u64)nr_snapshot * id / nr; i < end; i++) {
+	 * 		t = task_snapshot[i].task;
+	 * 		release_se_reserve(&t->se.statistics);
+	 * 		release_percpu_var_reserve(t);
+	 * 	}
+	 * } else if (id == 0) {
+	 * 	for_each_process_thread(p, t) {
+	 * 		release_se_reserve(&t->se.statistics);
+	 * 		release_percpu_var_reserve(t);
+	 * 	}
+	 * }
+
+	 * if (id != nr - 1)
+	 * 	return;
 	 * list_for_each_entry_rcu(tg, &task_groups, list) {
 	 * 	if (tg == &root_task_group || task_group_is_autogroup(tg))
 	 *		continue;
 	 * 	for_each_possible_cpu(cpu)
 	 * 		release_se_reserve(&tg->se[cpu]->statistics);
 	 * }
-
-	 * for_each_process_thread(p, t)
-	 * 	release_percpu_var_reserve(t);
 	 */
 }
 
 #else
 static inline int recheck_smps(void) { return 0; }
-static inline void sched_alloc_extrapad(void) { }
-static inline void sched_free_extrapad(void) { }
+static inline int sched_mempools_grow(void) { return 0; }
+static inline ssize_t sched_mempools_show(char *buf) { return 0; }
+static inline void sched_alloc_extrapad(int id, int nr) { }
+static inline void sched_free_extrapad(int id, int nr) { }
 static inline int sched_mempools_create(void) { return 0; }
 static inline int sched_mempools_destroy(void) { return 0; }
 #endif /* SCHEDMOD_MEMPOOL */
@@ -0,0 +1,212 @@
+/**
+ * Copyright 2019-2022 Alibaba Group Holding Limited.
+ * SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
+ */
+
+#ifndef __METRICS_H
+#define __METRICS_H
+
+#include <linux/kobject.h>
+#include <linux/sysfs.h>
+
+/*
+ * Cumulative load/unload latency metrics, exposed under
+ * /sys/kernel/plugsched/plugsched/metrics/ as text and json.
+ */
+enum {
+	PHASE_STOP_MACHINE,
+	PHASE_STOP_HANDLER,
+	PHASE_STACK_CHECK,
+	PHASE_STACK_CHECK_CPU_MAX,
+	PHASE_MEMPOOL_CREATE,
+	PHASE_REBUILD,
+	PHASE_DEQUEUE_CPU_MAX,
+	PHASE_ENQUEUE_CPU_MAX,
+	PHASE_BANDWIDTH_CPU_MAX,
+	PHASE_TOTAL,
+	NR_PHASES
+};
+
+static const char * const phase_names[NR_PHASES] = {
+	[PHASE_STOP_MACHINE]		= "stop_machine",
+	[PHASE_STOP_HANDLER]		= "stop_handler",
+	[PHASE_STACK_CHECK]		= "stack_check",
+	[PHASE_STACK_CHECK_CPU_MAX]	= "stack_check_cpu_max",
+	[PHASE_MEMPOOL_CREATE]		= "mempool_create",
+	[PHASE_REBUILD]			= "rebuild_sched_state",
+	[PHASE_DEQUEUE_CPU_MAX]		= "dequeue_cpu_max",
+	[PHASE_ENQUEUE_CPU_MAX]		= "enqueue_cpu_max",
+	[PHASE_BANDWIDTH_CPU_MAX]	= "bandwidth_cpu_max",
+	[PHASE_TOTAL]			= "total",
+};
+
+struct phase_metric {
+	unsigned long	count;
+	s64		last;
+	s64		min;
+	s64		max;
+};
+
+struct switch_metrics {
+	const char		*name;
+	/* Successful switches */
+	unsigned long		success;
+	/* Failed attempts, including mempool failures that aren't retried */
+	unsigned long		failures;
+	struct phase_metric	phase[NR_PHASES];
+};
+
+static struct switch_metrics load_metrics = { .name = "load" };
+static struct switch_metrics unload_metrics = { .name = "unload" };
+static struct kobject *metrics_dir;
+
+static DEFINE_PER_CPU(s64, stack_check_time);
+static DEFINE_PER_CPU(s64, rebuild_time);
+/* Measured by clear_sched_state and rebuild_sched_state */
+DECLARE_PER_CPU(s64, dequeue_time);
+DECLARE_PER_CPU(s64, enqueue_time);
+DECLARE_PER_CPU(s64, bandwidth_time);
+
+static s64 max_percpu_time(s64 __percpu *time)
+{
+	s64 ret = 0;
+	int cpu;
+
+	for_each_online_cpu(cpu)
+		ret = max(ret, *per_cpu_ptr(time, cpu));
+
+	return ret;
+}
+
+static void metric_update(struct switch_metrics *m, int phase, s64 ns)
+{
+	struct phase_metric *pm = &m->phase[phase];
+
+	if (!pm->count || ns < pm->min)
+		pm->min = ns;
+	if (!pm->count || ns > pm->max)
+		pm->max = ns;
+	pm->last = ns;
+	pm->count++;
+}
+
+static ssize_t switch_metrics_show(struct switch_metrics *m, char *buf)
+{
+	struct phase_metric *pm;
+	ssize_t len;
+	int i;
+
+	len = sprintf(buf, "success %lu\nfailures %lu\n", m->success, m->failures);
+	for (i = 0; i < NR_PHASES; i++) {
+		pm = &m->phase[i];
+		len += sprintf(buf + len, "%s %lld %lld %lld\n",
+				phase_names[i], pm->last, pm->min, pm->max);
+	}
+
+	return len;
+}
+
+static ssize_t switch_metrics_json(struct switch_metrics *m, char *buf)
+{
+	struct phase_metric *pm;
+	ssize_t len;
+	int i;
+
+	len = sprintf(buf, "\"%s\": {\"success\": %lu, \"failures\": %lu",
+			m->name, m->success, m->failures);
+	for (i = 0; i < NR_PHASES; i++) {
+		pm = &m->phase[i];
+		len += sprintf(buf + len,
+				", \"%s\": {\"last\": %lld, \"min\": %lld, \"max\": %lld}",
+				phase_names[i], pm->last, pm->min, pm->max);
+	}
+	len += sprintf(buf + len, "}");
+
+	return len;
+}
+
+static ssize_t load_show(struct kobject *kobj, struct kobj_attribute *attr,
+		char *buf)
+{
+	return switch_metrics_show(&load_metrics, buf);
+}
+
+static ssize_t unload_show(struct kobject *kobj, struct kobj_attribute *attr,
+		char *buf)
+{
+	return switch_metrics_show(&unload_metrics, buf);
+}
+
+static ssize_t json_show(struct kobject *kobj, struct kobj_attribute *attr,
+		char *buf)
+{
+	ssize_t len;
+
+	len = sprintf(buf, "{");
+	len += switch_metrics_json(&load_metrics, buf + len);
+	len += sprintf(buf + len, ", ");
+	len += switch_metrics_json(&unload_metrics, buf + len);
+	len += sprintf(buf + len, "}\n");
+
+	return len;
+}
+
+/* Stack check time of each cpu during the last switch */
+static ssize_t stack_check_percpu_show(struct kobject *kobj,
+		struct kobj_attribute *attr, char *buf)
+{
+	ssize_t len = 0;
+	int cpu;
+
+	for_each_online_cpu(cpu)
+		len += scnprintf(buf + len, PAGE_SIZE - len, "cpu%d %lld\n",
+				cpu, per_cpu(stack_check_time, cpu));
+
+	return len;
+}
+
+static struct kobj_attribute load_attr = __ATTR_RO(load);
+static struct kobj_attribute unload_attr = __ATTR_RO(unload);
+static struct kobj_attribute json_attr = __ATTR_RO(json);
+static struct kobj_attribute stack_check_percpu_attr = __ATTR_RO(stack_check_percpu);
+
+static struct attribute *metrics_attrs[] = {
+	&load_attr.attr,
+	&unload_attr.attr,
+	&json_attr.attr,
+	&stack_check_percpu_attr.attr,
+	NULL,
+};
+
+static const struct attribute_group metrics_attr_group = {
+	.attrs = metrics_attrs,
+};
+
+static int register_plugsched_metrics(struct kobject *parent)
+{
+	int ret;
+
+	metrics_dir = kobject_create_and_add("metrics", parent);
+	if (!metrics_dir)
+		return -ENOMEM;
+
+	ret = sysfs_create_group(metrics_dir, &metrics_attr_group);
+	if (ret) {
+		kobject_put(metrics_dir);
+		metrics_dir = NULL;
+	}
+
+	return ret;
+}
+
+static void unregister_plugsched_metrics(void)
+{
+	if (!metrics_dir)
+		return;
+
+	sysfs_remove_group(metrics_dir, &metrics_attr_group);
+	kobject_put(metrics_dir);
+	metrics_dir = NULL;
+}
+
+#endif
@@ -4,6 +4,7 @@
  */
 
 #include <linux/sched.h>
+#include <linux/llist.h>
 #include <linux/version.h>
 #include "sched.h"
 #include "helper.h"
@@ -16,7 +17,7 @@ extern void __mod_set_rq_offline(struct rq*);
 extern void __mod_set_rq_online(struct rq*);
 extern void __mod_update_rq_clock(struct rq *rq);
 
-extern unsigned int process_id[];
+DECLARE_PER_CPU(int, process_id);
 
 extern struct sched_class __orig_stop_sched_class;
 extern struct sched_class __orig_dl_sched_class;
@@ -46,6 +47,10 @@ struct sched_class *mod_class[] = {
 };
 
 DEFINE_PER_CPU(struct list_head, dying_task_list);
+DEFINE_PER_CPU(struct rebuild_bucket, rebuild_bucket);
+DEFINE_PER_CPU(s64, dequeue_time);
+DEFINE_PER_CPU(s64, enqueue_time);
+DEFINE_PER_CPU(s64, bandwidth_time);
 
 #define NR_SCHED_CLASS 5
 struct sched_class bak_class[NR_SCHED_CLASS];
@@ -86,10 +91,13 @@ void switch_sched_class(bool mod)
 void clear_sched_state(bool mod)
 {
 	struct task_struct *g, *p;
+	struct task_node *tn;
+	struct rebuild_bucket *bucket = this_cpu_ptr(&rebuild_bucket);
 	struct rq *rq = this_rq();
 	struct rq_flags rf;
 	int queue_flags = DEQUEUE_SAVE | DEQUEUE_MOVE | DEQUEUE_NOCLOCK;
 	int cpu = smp_processor_id();
+	ktime_t start = ktime_get();
 
 	rq_lock(rq, &rf);
 
@@ -101,15 +109,25 @@ void clear_sched_state(bool mod)
 		__orig_set_rq_offline(rq);
 	}
 
-	for_each_process_thread(g, p) {
-		if (rq != task_rq(p))
-			continue;
+	if (bucket->valid) {
+		/* Fully ordered, pairs with llist_add in stack check */
+		bucket->first = llist_del_all(&bucket->head);
+		llist_for_each_entry(tn, bucket->first, node) {
+			p = tn->task;
+			if (p != rq->stop && task_on_rq_queued(p))
+				p->sched_class->dequeue_task(rq, p, queue_flags);
+		}
+	} else {
+		for_each_process_thread(g, p) {
+			if (rq != task_rq(p))
+				continue;
 
-		if (p == rq->stop)
-			continue;
+			if (p == rq->stop)
+				continue;
 
-		if (task_on_rq_queued(p))
-			p->sched_class->dequeue_task(rq, p, queue_flags);
+			if (task_on_rq_queued(p))
+				p->sched_class->dequeue_task(rq, p, queue_flags);
+		}
 	}
 
 	INIT_LIST_HEAD(&per_cpu(dying_task_list, cpu));
@@ -127,23 +145,30 @@ void clear_sched_state(bool mod)
 			next = pick_next_task_rq(class, rf);
 			if (next) {
 				next->sched_class->put_prev_task(rq, next);
-				next->sched_class->dequeue_task(rq, p, queue_flags);
-				list_add_tail_rcu(&p->tasks, &per_cpu(dying_task_list, cpu));
+				next->sched_class->dequeue_task(rq, next, queue_flags);
+				list_add_tail_rcu(&next->tasks, &per_cpu(dying_task_list, cpu));
 				break;
 			}
 		}
 	}
 	rq_unlock(rq, &rf);
+
+	this_cpu_write(dequeue_time, ktime_to_ns(ktime_sub(ktime_get(), start)));
 }
 
 void rebuild_sched_state(bool mod)
 {
 	struct task_struct *g, *p;
+	struct task_node *tn;
+	struct rebuild_bucket *bucket = this_cpu_ptr(&rebuild_bucket);
 	struct task_group *tg;
 	struct rq *rq = this_rq();
 	struct rq_flags rf;
 	int queue_flags = ENQUEUE_RESTORE | ENQUEUE_MOVE | ENQUEUE_NOCLOCK;
 	int cpu = smp_processor_id();
+	int nr_cpus = num_online_cpus();
+	int idx = 0;
+	ktime_t start = ktime_get();
 
 	rq_lock(rq, &rf);
 
@@ -155,15 +180,25 @@ void rebuild_sched_state(bool mod)
 		__orig_set_rq_online(rq);
 	}
 
-	for_each_process_thread(g, p) {
-		if (rq != task_rq(p))
-			continue;
+	if (bucket->valid) {
+		llist_for_each_entry(tn, bucket->first, node) {
+			p = tn->task;
+			if (p != rq->stop && task_on_rq_queued(p))
+				p->sched_class->enqueue_task(rq, p, queue_flags);
+		}
+		bucket->first = NULL;
+		bucket->valid = false;
+	} else {
+		for_each_process_thread(g, p) {
+			if (rq != task_rq(p))
+				continue;
 
-		if (p == rq->stop)
-			continue;
+			if (p == rq->stop)
+				continue;
 
-		if (task_on_rq_queued(p))
-			p->sched_class->enqueue_task(rq, p, queue_flags);
+			if (task_on_rq_queued(p))
+				p->sched_class->enqueue_task(rq, p, queue_flags);
+		}
 	}
 
 	list_for_each_entry_rcu(p, &per_cpu(dying_task_list, cpu), tasks) {
@@ -172,13 +207,19 @@ void rebuild_sched_state(bool mod)
 	}
 	rq_unlock(rq, &rf);
 
-	if (process_id[cpu])
-		return;
+	this_cpu_write(enqueue_time, ktime_to_ns(ktime_sub(ktime_get(), start)));
+	start = ktime_get();
 
-	/* Restart the cfs/rt bandwidth timer */
+	/*
+	 * Restart the cfs/rt bandwidth timer, every cpu takes the task groups
+	 * whose index % nr_cpus is its process_id. The timers end up spread
+	 * over all cpus rather than piled on the first one.
+	 */
 	list_for_each_entry_rcu(tg, &task_groups, list) {
 		if (tg == &root_task_group)
 			continue;
+		if (idx++ % nr_cpus != this_cpu_read(process_id))
+			continue;
 
 		if (tg->cfs_bandwidth.period_active) {
 			hrtimer_restart(&tg->cfs_bandwidth.period_timer);
@@ -189,4 +230,6 @@ void rebuild_sched_state(bool mod)
 			hrtimer_restart(&tg->rt_bandwidth.rt_period_timer);
 #endif
 	}
+
+	this_cpu_write(bandwidth_time, ktime_to_ns(ktime_sub(ktime_get(), start)));
 }
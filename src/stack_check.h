@@ -2,6 +2,9 @@
 // SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
 
 #include <linux/list.h>
+#include <linux/llist.h>
+#include <linux/hash.h>
+#include <linux/bitmap.h>
 #include <trace/events/sched.h>
 #include <linux/stacktrace.h>
 
@@ -10,7 +13,188 @@
 extern const char *get_ksymbol(struct module *, unsigned long,
 		unsigned long *, unsigned long *);
 
-extern int process_id[];
+DECLARE_PER_CPU(int, process_id);
+extern unsigned long total_forks;
+
+DECLARE_PER_CPU(struct rebuild_bucket, rebuild_bucket);
+
+/*
+ * Tasks snapshotted before stop_machine, so that each cpu walks only its
+ * own slice rather than the whole task list. Tasks forked after the
+ * snapshot are detected by total_forks, in which case we fall back to
+ * walking the task list.
+ */
+static struct task_node *task_snapshot;
+static unsigned int nr_snapshot;
+static unsigned long snapshot_forks;
+
+static void rebuild_bucket_reset(void)
+{
+	struct rebuild_bucket *bucket;
+	int cpu;
+
+	for_each_possible_cpu(cpu) {
+		bucket = per_cpu_ptr(&rebuild_bucket, cpu);
+		init_llist_head(&bucket->head);
+		bucket->first = NULL;
+		bucket->valid = false;
+	}
+}
+
+static void task_snapshot_create(void)
+{
+	struct task_struct *p, *t;
+	unsigned int nr, i = 0;
+
+	rebuild_bucket_reset();
+
+	/* Leave some room for tasks forked before we take the lock */
+	nr = nr_threads + nr_threads / 8 + nr_cpu_ids;
+	task_snapshot = kvmalloc_array(nr, sizeof(*task_snapshot), GFP_KERNEL);
+	if (!task_snapshot)
+		return;
+
+	read_lock(&tasklist_lock);
+	snapshot_forks = total_forks;
+	for_each_process_thread(p, t) {
+		if (i == nr) {
+			/* Too many new tasks, treat the snapshot as stale */
+			snapshot_forks--;
+			break;
+		}
+		get_task_struct(t);
+		task_snapshot[i++].task = t;
+	}
+	read_unlock(&tasklist_lock);
+
+	nr_snapshot = i;
+}
+
+static void task_snapshot_destroy(void)
+{
+	unsigned int i;
+
+	if (!task_snapshot)
+		return;
+
+	/* Buckets of an aborted switch still point into the snapshot */
+	rebuild_bucket_reset();
+
+	for (i = 0; i < nr_snapshot; i++)
+		put_task_struct(task_snapshot[i].task);
+
+	kvfree(task_snapshot);
+	task_snapshot = NULL;
+	nr_snapshot = 0;
+}
+
+static inline bool task_snapshot_valid(void)
+{
+	return task_snapshot && READ_ONCE(total_forks) == snapshot_forks;
+}
+
+struct stack_busy_task {
+	pid_t		pid;
+	char		comm[TASK_COMM_LEN];
+	unsigned long	addr;
+};
+
+/* The first task found blocking the switch, reported to user space */
+static struct stack_busy_task stack_busy;
+static atomic_t stack_busy_set;
+
+#define MAX_DRY_RUN_REPORT	16
+
+/* Tasks found blocking the switch by the last dry run */
+static struct {
+	bool			done;
+	unsigned int		nr_busy;
+	unsigned int		nr_report;
+	struct stack_busy_task	report[MAX_DRY_RUN_REPORT];
+} dry_run;
+
+static inline void stack_busy_reset(void)
+{
+	atomic_set(&stack_busy_set, 0);
+}
+
+static void stack_busy_fill(struct stack_busy_task *busy,
+		struct task_struct *task, unsigned long addr)
+{
+	busy->pid = task->pid;
+	busy->addr = addr;
+	/* Can't take task_lock inside stop_machine, comm may be torn */
+	strncpy(busy->comm, task->comm, TASK_COMM_LEN - 1);
+	busy->comm[TASK_COMM_LEN - 1] = '\0';
+}
+
+static void stack_busy_record(struct task_struct *task, unsigned long addr)
+{
+	if (atomic_cmpxchg(&stack_busy_set, 0, 1))
+		return;
+
+	stack_busy_fill(&stack_busy, task, addr);
+}
+
+static ssize_t stack_busy_show(char *buf)
+{
+	if (!atomic_read(&stack_busy_set))
+		return 0;
+
+	return sprintf(buf, "pid=%d func=%ps comm=%s\n", stack_busy.pid,
+			(void *)stack_busy.addr, stack_busy.comm);
+}
+
+static ssize_t stack_dry_run_show(char *buf)
+{
+	struct stack_busy_task *busy;
+	ssize_t len;
+	int i;
+
+	if (!dry_run.done)
+		return 0;
+
+	len = sprintf(buf, "busy %u\n", dry_run.nr_busy);
+	for (i = 0; i < dry_run.nr_report; i++) {
+		busy = &dry_run.report[i];
+		len += sprintf(buf + len, "pid=%d func=%ps comm=%s\n",
+				busy->pid, (void *)busy->addr, busy->comm);
+	}
+
+	return len;
+}
+
+/*
+ * Bloom filter of the text pages covered by interface functions, one
+ * hashed bit per page. Most return addresses hit no interface page and
+ * are rejected without the binary search.
+ */
+#define FUNC_PAGES_SHIFT	16
+#define FUNC_PAGES_BITS		(1UL << FUNC_PAGES_SHIFT)
+
+static DECLARE_BITMAP(vm_func_pages, FUNC_PAGES_BITS);
+static DECLARE_BITMAP(mod_func_pages, FUNC_PAGES_BITS);
+
+static inline unsigned long func_page_hash(unsigned long addr)
+{
+	return hash_long(addr >> PAGE_SHIFT, FUNC_PAGES_SHIFT);
+}
+
+static void func_pages_init(unsigned long *pages, unsigned long *func_addr,
+		unsigned long *func_size)
+{
+	unsigned long addr;
+	int i;
+
+	bitmap_zero(pages, FUNC_PAGES_BITS);
+	for (i = 0; i < NR_INTERFACE_FN; i++) {
+		if (!func_size[i])
+			continue;
+		for (addr = func_addr[i] & PAGE_MASK;
+		     addr < func_addr[i] + func_size[i]; addr += PAGE_SIZE)
+			__set_bit(func_page_hash(addr), pages);
+	}
+}
 
 static void stack_check_init(void)
 {
@@ -43,31 +227,43 @@ static void stack_check_init(void)
 
 	mod_func_size[NR___schedule] = 0;
 	addr_sort(mod_func_addr, mod_func_size, NR_INTERFACE_FN);
+
+	func_pages_init(vm_func_pages, vm_func_addr, vm_func_size);
+	func_pages_init(mod_func_pages, mod_func_addr, mod_func_size);
 }
 
-static int stack_check_fn(unsigned long *entries, unsigned int nr_entries, bool install)
+static int stack_check_fn(unsigned long *entries, unsigned int nr_entries,
+		bool install, unsigned long *busy_addr)
 {
 	int i;
 	unsigned long *func_addr;
 	unsigned long *func_size;
+	unsigned long *func_pages;
 
 	if (install) {
 		func_addr = vm_func_addr;
 		func_size = vm_func_size;
+		func_pages = vm_func_pages;
 	} else {
 		func_addr = mod_func_addr;
 		func_size = mod_func_size;
+		func_pages = mod_func_pages;
 	}
 
 	for (i = 0; i < nr_entries; i++) {
 		int idx;
 		unsigned long address = entries[i];
 
+		if (!test_bit(func_page_hash(address), func_pages))
+			continue;
+
 		idx = bsearch(func_addr, 0, NR_INTERFACE_FN - 1, address);
 		if (idx == -1)
 			continue;
-		if (address < func_addr[idx] + func_size[idx])
+		if (address < func_addr[idx] + func_size[idx]) {
+			*busy_addr = address;
 			return -EAGAIN;
+		}
 	}
 
 	return 0;
@@ -155,10 +351,16 @@ static unsigned int get_stack_trace(struct task_struct *tsk,
 static int stack_check_task(struct task_struct *task, bool install)
 {
 	unsigned long entries[MAX_STACK_ENTRIES];
+	unsigned long busy_addr;
 	unsigned int nr_entries;
 
 	nr_entries = get_stack_trace(task, entries, MAX_STACK_ENTRIES);
-	return stack_check_fn(entries, nr_entries, install);
+	if (stack_check_fn(entries, nr_entries, install, &busy_addr)) {
+		stack_busy_record(task, busy_addr);
+		return -EAGAIN;
+	}
+
+	return 0;
 }
 
 static int stack_check(bool install)
@@ -167,18 +369,90 @@ static int stack_check(bool install)
 	int task_count = 0;
 	int nr_cpus = num_online_cpus();
 	int cpu = smp_processor_id();
-
-	for_each_process_thread(p, t) {
-		if ((task_count % nr_cpus) == process_id[cpu]) {
-			if (stack_check_task(t, install))
-				return -EBUSY;
+	int id = this_cpu_read(process_id);
+	ktime_t start = ktime_get();
+	int ret = 0;
+
+	if (task_snapshot_valid()) {
+		u64 i = (u64)nr_snapshot * id / nr_cpus;
+		u64 end = (u64)nr_snapshot * (id + 1) / nr_cpus;
+
+		for (; i < end; i++) {
+			t = task_snapshot[i].task;
+			if (stack_check_task(t, install)) {
+				ret = -EBUSY;
+				goto out;
+			}
+			/* Bucket queued tasks by cpu for the runqueue rebuild */
+			if (task_on_rq_queued(t))
+				llist_add(&task_snapshot[i].node,
+					&per_cpu(rebuild_bucket, task_cpu(t)).head);
+		}
+		/* Every cpu takes this branch, so our bucket will be complete */
+		this_cpu_ptr(&rebuild_bucket)->valid = true;
+	} else {
+		for_each_process_thread(p, t) {
+			if ((task_count % nr_cpus) == id) {
+				if (stack_check_task(t, install)) {
+					ret = -EBUSY;
+					goto out;
+				}
+			}
+			task_count++;
 		}
-		task_count++;
 	}
 
 	t = idle_task(cpu);
 	if (stack_check_task(t, install))
-		return -EBUSY;
+		ret = -EBUSY;
+
+out:
+	this_cpu_write(stack_check_time, ktime_to_ns(ktime_sub(ktime_get(), start)));
+	return ret;
+}
+
+static void stack_dry_run_task(struct task_struct *task, bool install)
+{
+	unsigned long entries[MAX_STACK_ENTRIES];
+	unsigned long busy_addr;
+	unsigned int nr_entries;
+
+	nr_entries = get_stack_trace(task, entries, MAX_STACK_ENTRIES);
+	if (!stack_check_fn(entries, nr_entries, install, &busy_addr))
+		return;
+
+	if (dry_run.nr_report < MAX_DRY_RUN_REPORT)
+		stack_busy_fill(&dry_run.report[dry_run.nr_report++], task, busy_addr);
+	dry_run.nr_busy++;
+}
+
+/*
+ * Run the same check as stack_check() on all tasks without stopping the
+ * machine, to predict whether the switch would succeed. Tasks keep running
+ * meanwhile, so the result is only a hint.
+ */
+static int stack_check_dry_run(bool install)
+{
+	unsigned int i;
+	int cpu;
+
+	memset(&dry_run, 0, sizeof(dry_run));
+
+	task_snapshot_create();
+	if (!task_snapshot)
+		return -ENOMEM;
+
+	for (i = 0; i < nr_snapshot; i++) {
+		if (task_snapshot[i].task != current)
+			stack_dry_run_task(task_snapshot[i].task, install);
+		cond_resched();
+	}
+
+	for_each_online_cpu(cpu)
+		stack_dry_run_task(idle_task(cpu), install);
+
+	task_snapshot_destroy();
+	dry_run.done = true;
 
 	return 0;
 }
@@ -0,0 +1,106 @@
+/**
+ * Copyright 2019-2023 Alibaba Group Holding Limited.
+ * SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
+ */
+
+/*
+ * Microbenchmark of releasing objects to a simple percpu mempool, which
+ * classifies every object address with is_simple_percpu_mempool_addr.
+ */
+
+#include <linux/module.h>
+#include <linux/slab.h>
+#include <linux/vmalloc.h>
+#include <linux/ktime.h>
+#include "helper.h"
+#include "mempool.h"
+
+static unsigned int nr_objs = 100000;
+module_param(nr_objs, uint, 0444);
+static unsigned int obj_size = 64;
+module_param(obj_size, uint, 0444);
+
+/* The linear scan is_simple_percpu_mempool_addr used to do */
+static bool linear_percpu_mempool_addr(struct simple_percpu_mempool *psmpool,
+		void *_addr)
+{
+	unsigned long addr, area_size, base;
+	int i;
+
+	addr = (unsigned long)_addr;
+	area_size = psmpool->obj_size * psmpool->objs_per_area;
+
+	for (i = 0; i < psmpool->areas; i++) {
+		base = psmpool->percpu_ptr[i];
+		if (addr >= base && addr < (base + area_size))
+			return true;
+	}
+
+	return false;
+}
+
+static s64 bench(struct simple_percpu_mempool *psmpool, void **objs,
+		bool (*is_addr)(struct simple_percpu_mempool *, void *),
+		unsigned int *hits)
+{
+	ktime_t start = ktime_get();
+	unsigned int i;
+
+	*hits = 0;
+	for (i = 0; i < nr_objs; i++)
+		*hits += is_addr(psmpool, objs[i]);
+
+	return ktime_to_ns(ktime_sub(ktime_get(), start));
+}
+
+static int __init mempool_bench_init(void)
+{
+	struct simple_percpu_mempool *psmpool;
+	unsigned int i, linear_hits, indexed_hits;
+	s64 linear, indexed;
+	void *outsider;
+	void **objs;
+	int ret = 0;
+
+	objs = vmalloc(sizeof(void *) * nr_objs);
+	if (!objs)
+		return -ENOMEM;
+
+	psmpool = simple_percpu_mempool_create(nr_objs, obj_size);
+	if (!psmpool) {
+		vfree(objs);
+		return -ENOMEM;
+	}
+
+	for (i = 0; i < nr_objs; i++)
+		objs[i] = simple_percpu_mempool_alloc(psmpool);
+
+	linear = bench(psmpool, objs, linear_percpu_mempool_addr, &linear_hits);
+	indexed = bench(psmpool, objs, is_simple_percpu_mempool_addr, &indexed_hits);
+
+	/* Objects not from the pool must not be claimed */
+	outsider = __alloc_percpu(obj_size, obj_size);
+	if (outsider && is_simple_percpu_mempool_addr(psmpool, outsider))
+		indexed_hits = 0;
+	free_percpu(outsider);
+
+	printk("mempool_bench: %u objs %u areas linear %lld ns indexed %lld ns\n",
+			nr_objs, psmpool->areas, linear, indexed);
+	if (linear_hits != nr_objs || indexed_hits != nr_objs) {
+		printk("mempool_bench: Error: misclassified objects\n");
+		ret = -EINVAL;
+	}
+
+	simple_percpu_mempool_destory(psmpool);
+	vfree(objs);
+
+	return ret;
+}
+
+static void __exit mempool_bench_exit(void)
+{
+}
+
+module_init(mempool_bench_init);
+module_exit(mempool_bench_exit);
+MODULE_LICENSE("GPL");
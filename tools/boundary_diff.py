@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Copyright 2019-2023 Alibaba Group Holding Limited.
+# SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
+
+"""boundary_diff.py - Compare *.boundary files of two collector backends
+
+Usage:
+  boundary_diff.py <kernel_src> <config_dir> [--suffix=<suffix>] [--all]
+  boundary_diff.py (-h | --help)
+
+Options:
+  -h --help           Show help.
+  --suffix=<suffix>   Suffix of the files to compare with *.boundary
+                      [default: .dwarf.boundary].
+  --all               Also show differences which can't affect extraction,
+                      eg. edges between functions out of mod_files.
+
+Collect the kernel twice, for example in the working directory:
+  make -f working/Makefile.plugsched collect plugsched_tmpdir=working/ plugsched_modpath=kernel/sched/mod/
+  python3 working/collect_dwarf.py .dwarf.boundary
+"""
+
+import json
+import logging
+import os
+import sys
+from docopt import docopt
+from yaml import load, resolver
+from yaml import CLoader as Loader
+import colorlog
+
+handler = logging.StreamHandler()
+handler.setFormatter(colorlog.ColoredFormatter(
+    '%(cyan)s%(asctime)s%(reset)s %(log_color)s%(levelname)s %(white)s%(message)s%(reset)s',
+    datefmt='%Y-%m-%d %H:%M:%S'))
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(handler)
+
+# Use set as the default sequencer for yaml
+Loader.add_constructor(
+    resolver.BaseResolver.DEFAULT_SEQUENCE_TAG,
+    lambda loader, node: set(loader.construct_sequence(node)))
+
+# Fields used by analyze.py and extract.py
+FN_FIELDS = ['l_brace_loc', 'r_brace_loc', 'name_loc', 'public', 'inline', 'weak', 'init', 'decl_str']
+VAR_FIELDS = ['name_loc', 'decl_start_line', 'external', 'public', 'decl_str']
+
+
+def freeze(obj):
+    if isinstance(obj, list):
+        return tuple(freeze(o) for o in obj)
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    return obj
+
+
+def load_boundary(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class BoundaryDiff(object):
+    def __init__(self, config, show_all):
+        self.mod_files = set(config['mod_files'])
+        sdcr = config['sidecar'] or set()
+        self.srcs = [f for f in config['mod_files'] if f.endswith('.c')]
+        self.srcs += [f[1] for f in sdcr]
+        self.show_all = show_all
+        self.diffs = 0
+
+    def report(self, src, kind, what, old, new):
+        self.diffs += 1
+        logging.warning('%s: %s %s: %s -> %s', src, kind, what, old, new)
+
+    def relevant(self, sig):
+        return self.show_all or sig[1] in self.mod_files or sig[1] == '?'
+
+    def diff_set(self, src, kind, old, new):
+        for item in sorted(old - new, key=str):
+            self.report(src, kind, item, 'present', 'missing')
+        for item in sorted(new - old, key=str):
+            self.report(src, kind, item, 'missing', 'present')
+
+    def diff_props(self, src, kind, old, new, fields):
+        self.diff_set(src, kind, set(old), set(new))
+        for key in sorted(set(old) & set(new), key=str):
+            for field in fields:
+                o, n = freeze(old[key].get(field)), freeze(new[key].get(field))
+                if o != n:
+                    self.report(src, kind, '%s.%s' % (key, field), o, n)
+
+    def diff(self, src, old, new):
+        self.diff_props(src, 'fn',
+                        {freeze(f['signature']): f for f in old['fn']},
+                        {freeze(f['signature']): f for f in new['fn']},
+                        FN_FIELDS)
+        self.diff_props(src, 'var',
+                        {(v['name'], v['file']): v for v in old['var']},
+                        {(v['name'], v['file']): v for v in new['var']},
+                        VAR_FIELDS)
+
+        edges = [{(freeze(e['from']), freeze(e['to'])) for e in b['edge']}
+                 for b in (old, new)]
+        if not self.show_all:
+            edges = [{e for e in es if self.relevant(e[0]) or self.relevant(e[1])}
+                     for es in edges]
+        self.diff_set(src, 'edge', *edges)
+
+        self.diff_set(src, 'callback', {freeze(c) for c in old['callback']},
+                      {freeze(c) for c in new['callback']})
+
+    def run(self, suffix):
+        for src in self.srcs:
+            old_f, new_f = src + '.boundary', src + suffix
+            if not os.path.exists(old_f) or not os.path.exists(new_f):
+                logging.error('%s: %s or %s not found', src, old_f, new_f)
+                self.diffs += 1
+                continue
+            self.diff(src, load_boundary(old_f), load_boundary(new_f))
+
+        logging.info('%d differences in %d files', self.diffs, len(self.srcs))
+        return self.diffs == 0
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+
+    with open(os.path.join(arguments['<config_dir>'], 'boundary.yaml')) as f:
+        config = load(f, Loader)
+
+    os.chdir(arguments['<kernel_src>'])
+    ok = BoundaryDiff(config, arguments['--all']).run(arguments['--suffix'])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Copyright 2019-2023 Alibaba Group Holding Limited.
+# SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
+
+"""rollout.py - Staged scheduler-installer rollout over many hosts
+
+Usage:
+  rollout.py (install | uninstall) [options] (--hosts-file=<file> | <host>...)
+  rollout.py (-h | --help)
+
+Options:
+  -h --help                 Show help.
+  --hosts-file=<file>       File with one host per line, '#' starts a comment.
+  --transport=<name>        How to reach hosts: ssh or local [default: ssh].
+  --stages=<list>           Comma separated stage sizes, absolute numbers or
+                            percentages of all hosts [default: 1,10%,100%].
+  --concurrency=<n>         Max hosts being operated at the same time [default: 16].
+  --max-attempts=<n>        Max installer runs per host [default: 3].
+  --backoff-base=<sec>      Base of the exponential backoff [default: 2].
+  --backoff-max=<sec>       Upper bound of a single backoff [default: 60].
+  --halt-error-rate=<rate>  Halt the rollout when the failure rate of the
+                            finished hosts exceeds this rate [default: 0.1].
+  --min-samples=<n>         Finished hosts needed before the error rate is
+                            trusted [default: 5].
+  --installer=<path>        Installer command on the hosts
+                            [default: /var/plugsched/$(uname -r)/scheduler-installer].
+  --report=<file>           Dump per-host results and metrics as JSON.
+"""
+
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from docopt import docopt
+import sh
+import colorlog
+
+handler = colorlog.StreamHandler()
+handler.setFormatter(colorlog.ColoredFormatter(
+    '%(cyan)s%(asctime)s%(reset)s %(log_color)s%(levelname)s %(white)s%(message)s%(reset)s',
+    datefmt='%Y-%m-%d %H:%M:%S'))
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(handler)
+
+# Phases reported by scheduler-installer with "scheduler: <phase> time is <n> ms"
+PHASES = ['conflict_check', 'symbol_resolve', 'insmod', 'enable']
+phase_re = re.compile(r'^scheduler: (\w+) time is (\d+) ms$', re.M)
+
+
+class LocalTransport(object):
+    """Run the installer on this machine, regardless of the host name.
+    Useful to exercise the rollout logic on a single test machine.
+    """
+
+    def run(self, host, cmd):
+        out = sh.bash('-c', cmd, _ok_code=range(256), _err_to_out=True)
+        return out.exit_code, str(out)
+
+
+class SshTransport(object):
+    """Run the installer on the host through non-interactive ssh"""
+
+    def run(self, host, cmd):
+        out = sh.ssh('-o', 'BatchMode=yes', host, cmd,
+                     _ok_code=range(256), _err_to_out=True)
+        return out.exit_code, str(out)
+
+
+TRANSPORTS = {
+    'local': LocalTransport,
+    'ssh':   SshTransport,
+}
+
+
+def backoff(attempt, base, cap):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def parse_stages(stages, nr_hosts):
+    """Turn '1,10%,100%' into cumulative host counts, eg. [1, 10, 100]"""
+    counts = []
+    for stage in stages.split(','):
+        stage = stage.strip()
+        if stage.endswith('%'):
+            count = -(-nr_hosts * int(stage[:-1]) // 100)
+        else:
+            count = int(stage)
+        counts.append(max(1, min(count, nr_hosts)))
+    if not counts or counts[-1] != nr_hosts:
+        counts.append(nr_hosts)
+    return sorted(set(counts))
+
+
+class Rollout(object):
+    def __init__(self, transport, op, installer, concurrency, max_attempts,
+                 backoff_base, backoff_max, halt_error_rate, min_samples):
+        self.transport = transport
+        self.op = op
+        self.installer = installer
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.halt_error_rate = halt_error_rate
+        self.min_samples = min_samples
+        self.results = {}
+        self.halted = threading.Event()
+        self.lock = threading.Lock()
+
+    def run_host(self, host):
+        """Run the installer on a host, retry with backoff on failure"""
+        result = {'host': host, 'ok': False, 'attempts': 0, 'phases': {}, 'output': ''}
+
+        for attempt in range(self.max_attempts):
+            if self.halted.is_set():
+                result['output'] = 'skipped, rollout halted'
+                break
+
+            result['attempts'] = attempt + 1
+            start = time.time()
+            code, out = self.transport.run(host, '%s %s' % (self.installer, self.op))
+            result['duration_ms'] = int((time.time() - start) * 1000)
+            result['output'] = out.strip()
+            result['phases'] = {k: int(v) for k, v in phase_re.findall(out)}
+
+            if code == 0:
+                result['ok'] = True
+                break
+
+            if attempt + 1 < self.max_attempts:
+                delay = backoff(attempt, self.backoff_base, self.backoff_max)
+                logging.warning('%s: %s failed (exit %d), retry in %.1fs',
+                                host, self.op, code, delay)
+                self.halted.wait(delay)
+
+        return result
+
+    def error_rate(self, force=False):
+        finished = [r for r in self.results.values() if r['attempts']]
+        if not finished or (len(finished) < self.min_samples and not force):
+            return 0.0
+        return 1.0 * sum(not r['ok'] for r in finished) / len(finished)
+
+    def record(self, result):
+        with self.lock:
+            self.results[result['host']] = result
+            if result['ok']:
+                logging.info('%s: %s succeed %s', result['host'], self.op, result['phases'])
+            elif result['attempts']:
+                logging.error('%s: %s failed after %d attempts: %s', result['host'],
+                              self.op, result['attempts'], result['output'])
+
+            self.check_error_rate()
+
+    def check_error_rate(self, force=False):
+        rate = self.error_rate(force)
+        if rate > self.halt_error_rate and not self.halted.is_set():
+            logging.error('Error rate %.2f exceeds %.2f, halting rollout',
+                          rate, self.halt_error_rate)
+            self.halted.set()
+
+    def run(self, hosts, stages):
+        done = 0
+        for stage, count in enumerate(stages):
+            batch = hosts[done:count]
+            logging.info('Stage %d: %s on %d hosts (%d/%d)', stage, self.op,
+                         len(batch), count, len(hosts))
+
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = [pool.submit(self.run_host, host) for host in batch]
+                for future in as_completed(futures):
+                    self.record(future.result())
+
+            done = count
+            # Small canary stages never reach min_samples, judge them anyway
+            self.check_error_rate(force=True)
+            if self.halted.is_set():
+                logging.error('Rollout halted at stage %d, %d hosts untouched',
+                              stage, len(hosts) - done)
+                break
+
+        return not self.halted.is_set() and all(r['ok'] for r in self.results.values())
+
+    def metrics(self):
+        """Latency percentiles of every installer phase over all hosts"""
+        samples = {phase: [] for phase in PHASES + ['duration']}
+        for r in self.results.values():
+            for phase, ms in r['phases'].items():
+                samples.setdefault(phase, []).append(ms)
+            if 'duration_ms' in r:
+                samples['duration'].append(r['duration_ms'])
+
+        return {phase: {
+                    'count': len(values),
+                    'p50': percentile(values, 50),
+                    'p90': percentile(values, 90),
+                    'p99': percentile(values, 99),
+                    'max': max(values),
+                } for phase, values in samples.items() if values}
+
+
+def read_hosts(arguments):
+    if not arguments['--hosts-file']:
+        return arguments['<host>']
+
+    with open(arguments['--hosts-file']) as f:
+        hosts = [l.split('#')[0].strip() for l in f]
+    return [h for h in hosts if h]
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+
+    if arguments['--transport'] not in TRANSPORTS:
+        logging.fatal('Unknown transport %s', arguments['--transport'])
+        sys.exit(1)
+
+    hosts = read_hosts(arguments)
+    if not hosts:
+        logging.fatal('No host to operate')
+        sys.exit(1)
+
+    rollout = Rollout(TRANSPORTS[arguments['--transport']](),
+                      'install' if arguments['install'] else 'uninstall',
+                      arguments['--installer'],
+                      int(arguments['--concurrency']),
+                      int(arguments['--max-attempts']),
+                      float(arguments['--backoff-base']),
+                      float(arguments['--backoff-max']),
+                      float(arguments['--halt-error-rate']),
+                      int(arguments['--min-samples']))
+
+    ok = rollout.run(hosts, parse_stages(arguments['--stages'], len(hosts)))
+    metrics = rollout.metrics()
+    for phase, m in metrics.items():
+        logging.info('%-15s count %-6d p50 %-8d p90 %-8d p99 %-8d max %d (ms)', phase,
+                     m['count'], m['p50'], m['p90'], m['p99'], m['max'])
+
+    if arguments['--report']:
+        with open(arguments['--report'], 'w') as f:
+            json.dump({'hosts': list(rollout.results.values()), 'metrics': metrics},
+                      f, indent=4)
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Copyright 2019-2023 Alibaba Group Holding Limited.
+# SPDX-License-Identifier: GPL-2.0 OR BSD-3-Clause
+
+"""springboard_search.py - Find the springboard, stack size, stack protector
+and frame layout of __schedule, from one disassembly of the function.
+
+Usage:
+  springboard_search.py init  <object> <config> <cache_dir>
+  springboard_search.py build <object> <cache_dir>
+
+Results are cached by the build-id of the object (or its digest when it
+has none) in <cache_dir>, working/springboard_cache by plugsched.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import re
+import sys
+from sh import objdump, readelf
+
+SYMBOL = '__schedule'
+
+label_re = re.compile(r' <.*>:$')
+symtab_re = re.compile(r'^([0-9a-f]+)\s+(.*)\s(\S+)\s+([0-9a-f]+)\s+(?:\.hidden\s+)?(\S+)$')
+build_id_re = re.compile(r'Build ID: ([0-9a-f]+)')
+
+
+def fatal(msg):
+    sys.stderr.write('ERROR: %s\n' % msg)
+    sys.exit(1)
+
+
+def hexdump(s):
+    """Same as `hexdump -ve '"%x"'`, 4 byte native words without padding"""
+    data = s.encode()
+    return ''.join('%x' % int.from_bytes(data[i:i + 4].ljust(4, b'\0'), sys.byteorder)
+                   for i in range(0, len(data), 4))
+
+
+def object_key(obj):
+    for line in readelf('-n', obj, _ok_code=range(256)).splitlines():
+        m = build_id_re.search(line)
+        if m:
+            return m.group(1)
+
+    digest = hashlib.sha256()
+    with open(obj, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Search(object):
+    def __init__(self, obj, arch):
+        self.obj = obj
+        self.arch = arch
+        self.start, self.end, self.section = self.function_range()
+        self.lines = self.function_asm()
+        # Instruction lines split like awk does
+        self.insns = [l.split() for l in self.lines
+                      if not l.startswith('Disassembly of section')]
+
+    def function_range(self):
+        for line in objdump('-t', self.obj).splitlines():
+            m = symtab_re.match(line)
+            if m and m.group(5) == SYMBOL and 'F' in m.group(2).split():
+                start = int(m.group(1), 16)
+                return start, start + int(m.group(4), 16), m.group(3)
+        fatal('%s function range not found in target object' % SYMBOL)
+
+    def function_asm(self):
+        out = objdump('-d', '-j', self.section,
+                      '--start-address=%#x' % self.start,
+                      '--stop-address=%#x' % self.end, self.obj)
+        lines = [l for l in out.splitlines() if l and not label_re.search(l)]
+        for i, line in enumerate(lines):
+            if line.startswith('Disassembly of section'):
+                return lines[i:]
+        return []
+
+    def stack_size(self):
+        if self.arch == 'x86_64':
+            # sub $0x48,%rsp
+            for line in self.lines:
+                if re.search(r'sub.*,%rsp', line):
+                    size = line.split()[-1]
+                    return size.split(',')[0].split('$', 1)[-1]
+        else:
+            # stp x29, x30, [sp, #-112]!
+            for line in self.lines:
+                if re.search(r'stp\s*x29, x30', line):
+                    size = line.split()[-1]
+                    return size.rsplit(']', 1)[0].split('-', 1)[-1]
+        fatal('stack_size of %s not found in target object.' % SYMBOL)
+
+    def springboard(self):
+        target = '<__switch_to_asm>' if self.arch == 'x86_64' else '<__switch_to>'
+        for fields in self.insns:
+            if fields and fields[-1] == target:
+                return int(fields[0].rstrip(':'), 16) - self.start
+        fatal('springboard not found in target object.')
+
+    def stack_layout(self):
+        """Hexdump of the operand of the first push/stp, eg. %rbp"""
+        mnemonic = 'push' if self.arch == 'x86_64' else 'stp'
+        tokens = ' '.join(self.lines).split()
+        for i, token in enumerate(tokens[:-1]):
+            if token == mnemonic:
+                return hexdump(tokens[i + 1] + '\n')
+        return ''
+
+    def stack_protector(self):
+        """Offset and length of the stack protector check sequence, the
+        first "ldr ldr (any ){1,4}chk (ldp ){5,6}ret", where chk is the
+        branch to the call of __stack_chk_fail.
+        """
+        if self.arch == 'x86_64':
+            return None
+
+        chk_fail = None
+        for fields in self.insns:
+            if len(fields) > 2 and fields[2] == 'bl' and fields[-1] == '<__stack_chk_fail>':
+                chk_fail = int(fields[0].rstrip(':'), 16)
+                break
+        if chk_fail is None:
+            fatal('__stack_chk_fail not called by %s' % SYMBOL)
+
+        chk_targets = {'<%s+%#x>' % (SYMBOL, chk_fail - self.start),
+                       '<%s+%#x>' % (SYMBOL, chk_fail - self.start - 4)}
+        seq = []
+        for fields in self.insns:
+            mnemonic = fields[2] if len(fields) > 2 else None
+            if mnemonic in ('ldr', 'ldp', 'ret'):
+                seq.append(mnemonic)
+            elif (len(fields) > 4 and fields[4] in chk_targets) or \
+                    (len(fields) > 5 and fields[5] in chk_targets):
+                seq.append('chk')
+            else:
+                seq.append('any')
+
+        # Every word takes 4 bytes like an instruction, so the offset in
+        # the string is the offset in the function.
+        seq = ' '.join(seq)
+        m = re.search(r'ldr ldr (any ){1,4}chk (ldp ){5,6}ret', seq)
+        if not m or m.start() == 0:
+            fatal('Stack protector sequence "ldr ldr (any ){1,4}chk (ldp ){6}ret" not found:\n' + seq)
+
+        length = len(m.group(0)[:m.group(0).index('chk') + 3].split())
+        return m.start(), length
+
+    def init(self, stack_protector):
+        out = ['ccflags-y += -DSPRINGBOARD=%d' % self.springboard(),
+               'ccflags-y += -DSTACKSIZE_VMLINUX=%s' % self.stack_size()]
+        if stack_protector:
+            protector = self.stack_protector()
+            if protector:
+                out += ['ccflags-y += -DSTACK_PROTECTOR=%d' % protector[0],
+                        'ccflags-y += -DSTACK_PROTECTOR_LEN=%d' % protector[1]]
+        out.append('ccflags-y += -DVMLINUX_FRAME_POINTER=0x%s' % self.stack_layout())
+        return '\n'.join(out)
+
+    def build(self):
+        return '-DSTACKSIZE_MOD=%s -DMODULE_FRAME_POINTER=0x%s' % (
+            self.stack_size(), self.stack_layout())
+
+
+def read_config(config):
+    with open(config) as f:
+        return 'CONFIG_STACKPROTECTOR=y' in f.read()
+
+
+def cached(cache_dir, key, compute):
+    path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(path) as f:
+            return json.load(f)['output']
+    except (IOError, ValueError, KeyError):
+        pass
+
+    output = compute()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'output': output}, f)
+        os.rename(path + '.tmp', path)
+    except OSError:
+        pass
+    return output
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] not in ('init', 'build') or \
+            (sys.argv[1] == 'init' and len(sys.argv) < 5):
+        fatal('Usage: springboard_search.py <stage> <object> [<config>] <cache_dir>.')
+
+    stage, obj, cache_dir = sys.argv[1], sys.argv[2], sys.argv[-1]
+    arch = platform.machine()
+
+    if stage == 'init':
+        protector = read_config(sys.argv[3])
+        key = '%s-%s-%s-%d' % (object_key(obj), stage, arch, protector)
+        print(cached(cache_dir, key, lambda: Search(obj, arch).init(protector)))
+    else:
+        key = '%s-%s-%s' % (object_key(obj), stage, arch)
+        print(cached(cache_dir, key, lambda: Search(obj, arch).build()))